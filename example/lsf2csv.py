@@ -20,7 +20,7 @@ def tojson(msg_or_value) -> str:
         json_string = json_delimiter.join([msg_id] + [f'"{field}" : {value}' for field, value in zip(fields, values)])
         
         return '{' + json_string + '}' 
-    elif isinstance(msg_or_value, list):
+    elif isinstance(msg_or_value, (list, tuple)):
         return '[' + json_delimiter.join([tojson(i) for i in msg_or_value]) + ']'
     elif isinstance(msg_or_value, int) or isinstance(msg_or_value, float):
         return str(msg_or_value)
@@ -47,7 +47,7 @@ def todict(msg_or_value) -> dict:
         json_dict = { f : v for f, v in zip(["Message id"] + fields, [msg_or_value.Attributes.id] + values) }
         
         return json_dict
-    elif isinstance(msg_or_value, list):
+    elif isinstance(msg_or_value, (list, tuple)):
         return [todict(i) for i in msg_or_value]
     elif isinstance(msg_or_value, bytes):
         return str(base64.b64encode(msg_or_value), encoding="ascii")
@@ -18,7 +18,7 @@ def tolist(msg_or_value) -> list:
         values = [tolist(getattr(msg_or_value, f)) for f in fields if tolist(getattr(msg_or_value, f)) is not None]
         
         return [[f, v] for (f, v) in zip(fields, values)]
-    elif isinstance(msg_or_value, list):
+    elif isinstance(msg_or_value, (list, tuple)):
         return [tolist(i) for i in msg_or_value]
     elif isinstance(msg_or_value, int) or isinstance(msg_or_value, float):
         return msg_or_value
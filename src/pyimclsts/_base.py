@@ -6,7 +6,9 @@ Considered operations to be protected:
     - Assignment;
         - Attributes should not be re-assigned with invalid types
     - Access (getter);
-        - A reference to a mutable object should not inadvertently be exposed
+        - A reference to a mutable object should not inadvertently be exposed. Messages stored
+        inside other messages are frozen and message-lists are stored as tuples, so the getter
+        can return the stored reference without copying it.
     - Initialization.
         - Attributes should not be initialized with invalid types
     - Dynamic creation of attributes
@@ -14,11 +16,11 @@ Considered operations to be protected:
         dangerous per se, this might induce programming errors)
 '''
 
-import copy
 from enum import IntEnum, IntFlag
 from collections import namedtuple
 import time
-from typing import Optional, Any
+import struct
+from typing import Optional, Any, Callable, Tuple
 
 import pyimclsts.core as core
 from . import enumerations as imc_enums
@@ -37,9 +39,56 @@ IMC_message = core.IMC_message
 
 imc_types = %IMC_TYPES%
 
+def _freeze(message : Optional[IMC_message]) -> Optional[IMC_message]:
+    '''Marks a message as frozen, that is, its fields can no longer be re-assigned. 
+    Messages are frozen when they are stored inside another message.'''
+    if message is not None:
+        message._frozen = True
+    return message
+
+def _freeze_list(message_list : Optional[Any]) -> Optional[tuple]:
+    '''Freezes the messages of a message-list and returns them as a tuple.'''
+    if message_list is not None:
+        return tuple([_freeze(m) for m in message_list])
+    return None
+
+def _frozen_copy(message : Optional[IMC_message]) -> Optional[IMC_message]:
+    '''Returns a frozen copy of a message given by the user, so that the given object remains mutable. 
+    Messages that are already frozen cannot change and are shared.'''
+    if message is not None and not getattr(message, '_frozen', False):
+        return _freeze(message.copy())
+    return message
+
+def _frozen_copy_list(message_list : Optional[Any]) -> Optional[tuple]:
+    '''Returns the frozen copies of the messages of a message-list given by the user, as a tuple.'''
+    if message_list is not None:
+        return tuple([_frozen_copy(m) for m in message_list])
+    return None
+
+def _enum_lookup(enum_class : Any) -> Callable[[int], Any]:
+    '''Returns a function that converts a decoded integer to a member of the given enumeration (or bitfield),
+    through a lookup table, instead of calling the enumeration constructor for every message. 
+    
+    Values that are not in the table (for example, combinations of flags) are converted by the constructor
+    and added to the table. Unlike the validated path, values that are not defined (e.g. sent by a system
+    with a newer IMC version) are kept as plain integers instead of raising a ValueError, so that a single
+    message cannot stop the receiver.'''
+    table = {member.value : member for member in enum_class}
+
+    def lookup(value : int) -> Any:
+        member = table.get(value, None)
+        if member is None:
+            try:
+                member = enum_class(value)
+            except ValueError:
+                return value
+            table[value] = member
+        return member
+    return lookup
+
 class base_message(IMC_message):
     
-    __slots__ = ['_header', '_footer', 'Attributes']
+    __slots__ = ['_header', '_footer', '_frozen', 'Attributes']
 
     def __str__(self) -> str:
         output = ['Message \'' + self.Attributes.name + '\':', 'Fields:']
@@ -66,7 +115,7 @@ class base_message(IMC_message):
 
                 elif isinstance(value, IMC_message):
                     value = ('\n' + str(value)).replace('\n', '\n    ')
-                elif type(value) == list:
+                elif type(value) == tuple:
                     value = ('\n[\n' + '\n'.join([str(v) for v in value]) + '\n]').replace('\n', '\n    ')
                 else:
                     value = str(value)
@@ -128,22 +177,21 @@ class base_message(IMC_message):
         return False
 
     def _pack_fields(self, *, serial_functions : dict) -> bytes:
-        # Check if any field is empty (None) and not type 'message' (checked through the descriptor)
-        if any([getattr(self, '_' + field) is None for field in self.Attributes.fields if getattr(getattr(type(self), field), '_field_def').get('type', None) != 'message']):
+        # Fields' types, as described in the descriptors
+        field_types = _get_message_class(self.Attributes.id)[1]
+        values = [getattr(self, '_' + field) for field in self.Attributes.fields]
+
+        # Check if any field is empty (None) and not type 'message'
+        if any([v is None and t != 'message' for v, t in zip(values, field_types)]):
             raise ValueError('Cannot serialize a message that contains an empty (NoneType) field that is not a message.')
         
-        serial_functions = serial_functions
-
         serialized_fields = []
-        for field in self.Attributes.fields:
-            # Access variable information through the descriptor
-            datatype = getattr(getattr(type(self), field), '_field_def').get('type', None)
-            
+        for value, datatype in zip(values, field_types):
             # check if it is a "NULL" message
-            if datatype == 'message' and getattr(self, '_' + field) is None:
+            if value is None:
                 serialized_fields.append(serial_functions['uint16_t'](65535))
             else:
-                serialized_fields.append(serial_functions[datatype](getattr(self, '_' + field)))
+                serialized_fields.append(serial_functions[datatype](value))
         
         return b''.join(serialized_fields)
 
@@ -174,9 +222,11 @@ class base_message(IMC_message):
         
         header_fields_values = header_data(sync=_sync_number, mgid=mgid, size=size, timestamp=_timestamp, src=_src, src_ent=_src_ent, dst=_dst, dst_ent=_dst_ent)
         
-        self._header = header_fields_values
+        # A frozen message (for example, a received message shared among callbacks) keeps its header
+        if not getattr(self, '_frozen', False):
+            self._header = header_fields_values
 
-        return serial_functions['header'](*self._header)
+        return serial_functions['header'](*header_fields_values)
     
     def pack(self, *, is_field_message : bool = False, is_big_endian : bool = True, src : Optional[int] = None, src_ent : Optional[int] = None, 
                         dst : Optional[int] = None, dst_ent : Optional[int] = None) -> bytes:
@@ -193,26 +243,381 @@ class base_message(IMC_message):
             
             # footer:
             '''Calculates CRC-16 IBM of a bit string'''
-            self._footer = core.CRC16IMB(s_message)
-            s_message = s_message + serial_functions['uint16_t'](self._footer)
+            footer = core.CRC16IMB(s_message)
+            if not getattr(self, '_frozen', False):
+                self._footer = footer
+            s_message = s_message + serial_functions['uint16_t'](footer)
 
             return s_message
         return serial_functions['uint16_t'](self.Attributes.id) + s_fields
 
+    def copy(self) -> 'base_message':
+        '''Returns a mutable copy of the message (and its header, if any).
+        
+        Nested messages and message-lists are frozen, therefore they are shared with the copy
+        instead of being copied. To modify a nested message, copy it and re-assign it.'''
+        new_message = type(self).__new__(type(self))
+        for field in self.Attributes.fields:
+            setattr(new_message, '_' + field, getattr(self, '_' + field))
+        if hasattr(self, '_header'):
+            new_message._header = self._header
+        if hasattr(self, '_footer'):
+            new_message._footer = self._footer
+        return new_message
+
+    def __copy__(self) -> 'base_message':
+        return self.copy()
+
+    def __deepcopy__(self, memo : dict) -> 'base_message':
+        return self.copy()
+
+    def __reduce__(self) -> tuple:
+        '''Pickles the message as its serialized (IMC) fields and header, which is much smaller and faster 
+        to (un)pickle than its fields, nested messages and enumerations. 
+        
+        The unpickled message is decoded with unpack (fast mode). Incomplete messages (that cannot be
+        serialized), unknown messages and messages whose fp32_t fields hold values that are not exactly
+        representable in single precision (which serializing would round, e.g. messages created locally 
+        rather than received) are pickled by their fields' values, so that the unpickled message is always 
+        equal to the original.'''
+        header = getattr(self, '_header', None)
+        if _get_message_class(self.Attributes.id) is not None and _packs_exactly(self):
+            try:
+                fields = self.pack(is_field_message=True)
+                return (_unpickle, (fields, core.pack_functions_big['header'](*header) if header is not None else None))
+            except ValueError:
+                pass
+        
+        values = tuple([getattr(self, '_' + field, None) for field in self.Attributes.fields])
+        return (_unpickle_fields, (type(self), values, header))
+
     def get_timestamp(self) -> Optional[float]:
         '''Get the timestamp. Returns None if the message has no header yet.'''
         if hasattr(self, '_header'):
             return self._header.timestamp
         return None
     
+def _unpickle(fields : bytes, header : Optional[bytes]) -> base_message:
+    '''Rebuilds a pickled message (see base_message.__reduce__)'''
+    message = unpack(fields, is_big_endian=True, is_field_message=True, fast_mode=True)[0]
+    if header is not None:
+        message._header = header_data(*core.unpack_functions_big['header'](header)[0])
+    return message
+
+def _unpickle_fields(cls : Any, values : tuple, header : Optional[header_data]) -> base_message:
+    '''Rebuilds a message pickled by its fields' values (see base_message.__reduce__)'''
+    message = cls.__new__(cls)
+    for field, value in zip(cls.Attributes.fields, values):
+        # nested messages are stored frozen
+        if isinstance(value, base_message):
+            value = _freeze(value)
+        elif isinstance(value, tuple):
+            value = _freeze_list(value)
+        setattr(message, '_' + field, value)
+    if header is not None:
+        message._header = header
+    return message
+
+_fp32 = struct.Struct('>f')
+
+def _packs_exactly(message : base_message) -> bool:
+    '''Checks whether serializing the message (and its nested messages) keeps all of its values, that is,
+    whether its fp32_t fields hold values that are exactly representable in single precision.'''
+    message_class = _get_message_class(message.Attributes.id)
+    if message_class is None:
+        return False
+    for field, field_type in zip(message.Attributes.fields, message_class[1]):
+        value = getattr(message, '_' + field, None)
+        if value is None:
+            continue
+        if field_type == 'fp32_t':
+            # NaN is never equal to itself, but is kept. Values beyond the single precision range cannot be packed.
+            try:
+                if isinstance(value, float) and value == value and _fp32.unpack(_fp32.pack(value))[0] != value:
+                    return False
+            except OverflowError:
+                return False
+        elif field_type == 'message':
+            if not _packs_exactly(value):
+                return False
+        elif field_type == 'message-list':
+            if not all([_packs_exactly(m) for m in value]):
+                return False
+    return True
+
+def _messages() -> Any:
+    '''Returns the (generated) messages module. Imported when needed, since it imports this module.'''
+    from . import messages
+    return messages
+
+# a dictionary of {message id : (message class, (field types...))}
+_message_classes = dict()
+
+def _get_message_class(msgid : int) -> Optional[Tuple[Any, Tuple[str, ...]]]:
+    '''Returns the class of the given message id and the types of its fields (in the order of Attributes.fields), 
+    as described in its descriptors, or None if the message id is not known. Cached, to avoid instantiating 
+    the class and inspecting it on every message.'''
+    message_class = _message_classes.get(msgid, None)
+    if message_class is None:
+        messages = _messages()
+        if msgid not in messages._message_ids:
+            return None
+        cls = getattr(messages, messages._message_ids[msgid])
+        message_class = (cls, tuple([getattr(cls, f)._field_def['type'] for f in cls.Attributes.fields]))
+        _message_classes[msgid] = message_class
+    return message_class
+
+# Struct formats of the fixed size types
+_decode_formats = {'int8_t' : 'b', 'uint8_t' : 'B', 'int16_t' : 'h', 'uint16_t' : 'H', 'int32_t' : 'i', 'uint32_t' : 'I', 
+                   'int64_t' : 'q', 'fp32_t' : 'f', 'fp64_t' : 'd'}
+_decode_header = {False : struct.Struct('<HHHdHBHB'), True : struct.Struct('>HHHdHBHB')}
+_decode_uint16 = {False : struct.Struct('<H').unpack_from, True : struct.Struct('>H').unpack_from}
+
+# a dictionary of {(message id, is big endian) : decoder of its fields}
+_decoders = dict()
+
+def _get_decoder(msgid : int, is_big_endian : bool) -> tuple:
+    '''Returns the decoder of the fields of a (known) message id. That is, in order: a struct for each run of 
+    fixed size fields and the type of each variable size field. Cached.'''
+    decoder = _decoders.get((msgid, is_big_endian), None)
+    if decoder is None:
+        decoder = []
+        run = ''
+        for t in _get_message_class(msgid)[1] + (None,):
+            if t in _decode_formats:
+                run += _decode_formats[t]
+                continue
+            if run != '':
+                decoder.append(struct.Struct(('>' if is_big_endian else '<') + run))
+                run = ''
+            if t is not None:
+                decoder.append(t)
+        decoder = tuple(decoder)
+        _decoders[(msgid, is_big_endian)] = decoder
+    return decoder
+
+def _decode_fields(message : bytes, cursor : int, decoder : tuple, is_big_endian : bool) -> Tuple[list, int]:
+    '''Decodes the fields described by decoder, starting at cursor, without slicing message. 
+    Returns their values and the position after them.'''
+    values = []
+    uint16 = _decode_uint16[is_big_endian]
+    for op in decoder:
+        if type(op) is not str:
+            values += op.unpack_from(message, cursor)
+            cursor += op.size
+        elif op == 'rawdata' or op == 'plaintext':
+            n = uint16(message, cursor)[0]
+            value = message[cursor + 2:cursor + 2 + n]
+            values.append(value if op == 'rawdata' else value.decode(encoding = 'ascii', errors='surrogateescape'))
+            cursor += 2 + n
+        elif op == 'message':
+            (m, cursor) = _decode_inline(message, cursor, is_big_endian)
+            values.append(m)
+        else:
+            # message-list
+            n = uint16(message, cursor)[0]
+            cursor += 2
+            message_list = []
+            for _ in range(n):
+                (m, cursor) = _decode_inline(message, cursor, is_big_endian)
+                message_list.append(m)
+            values.append(message_list)
+    return (values, cursor)
+
+def _decode_inline(message : bytes, cursor : int, is_big_endian : bool) -> Tuple[Optional[base_message], int]:
+    '''Decodes an inline message (or its absence) and returns it and the position after it.'''
+    msgid = _decode_uint16[is_big_endian](message, cursor)[0]
+    cursor += 2
+    if msgid == 65535:
+        return (None, cursor)
+    message_class = _get_message_class(msgid)
+    if message_class is None:
+        raise KeyError(f'Cannot parse/unpack an unknown inlined message (no information about the size). Add message id {msgid} to extract list')
+    (values, cursor) = _decode_fields(message, cursor, _get_decoder(msgid, is_big_endian), is_big_endian)
+    return (message_class[0]._from_decoded(values), cursor)
+
+def unpack(message : bytes, *, is_big_endian : Optional[bool] = None, is_field_message : bool = False, fast_mode : bool = False,
+            pool : Optional[dict] = None) -> Any:
+    '''Expects a serializable (= exactly long (header + fields + CRC)) string of bits whose CRC has already been checked
+    
+    Fast mode skips all type checking performed by the descriptor by directly invoking the trusted
+    constructor (_from_decoded). Enumerations and bitfields are converted in both modes.
+
+    pool is an optional {message id : message} dictionary (fast mode only). If the id of the message is in it, 
+    that message is refilled in place and returned (borrowed), instead of creating a new one. Nested messages
+    are always new.
+    '''
+    if is_big_endian is None:
+        is_big_endian = int.from_bytes(message[:2], byteorder='big') == _sync_number
+        # Note: is_big_endian is a function parameter to enable recursion
+    
+    unpack_functions = core.unpack_functions_big if is_big_endian else core.unpack_functions_little
+    cursor = 0
+    
+    if not is_field_message:
+        # deserialize header
+        deserialized_header = header_data._make(_decode_header[is_big_endian].unpack_from(message, cursor))
+        cursor += 20
+    
+        msgid = deserialized_header.mgid
+        message_class = _get_message_class(msgid)
+        if message_class is None:
+            unknown_msg = _messages().Unknown(msgid, contents = message[cursor:-2], endianness = is_big_endian)
+            unknown_msg._header = deserialized_header
+            return unknown_msg
+    else:
+        msgid = unpack_functions['uint16_t'](message[cursor:cursor+2])[0]
+        cursor += 2
+        message_class = _get_message_class(msgid)
+        if message_class is None:
+            raise KeyError(f'Cannot parse/unpack an unknown inlined message (no information about the size). Add message id {msgid} to extract list')
+    
+    # corresponding class and its fields' types
+    message_class, field_types = message_class
+
+    if fast_mode:
+        # decode the values (runs of fixed size fields at once) and instantiate class through the trusted constructor
+        (values, cursor) = _decode_fields(message, cursor, _get_decoder(msgid, is_big_endian), is_big_endian)
+        message_class = message_class._from_decoded(values, pool.get(msgid, None) if pool is not None else None)
+        
+    else:
+        # instantiate empty class
+        message_class = message_class()
+
+        # deserialize fields
+        for field, t in zip(message_class.Attributes.fields, field_types):
+            if t == 'message':
+                if unpack_functions['uint16_t'](message[cursor:cursor+2])[0] == 65535:
+                    cursor += 2
+                else:
+                    (m, size) = unpack(message[cursor:], is_big_endian=is_big_endian, is_field_message=True, fast_mode=fast_mode)
+                    cursor += size
+                    setattr(message_class, field, m)
+            elif t == 'message-list':
+                (n, _) = unpack_functions['uint16_t'](message[cursor:])
+                cursor += 2
+                message_list = []
+                for _ in range(n):
+                    (m, size) = unpack(message[cursor:], is_big_endian=is_big_endian, is_field_message=True, fast_mode=fast_mode)
+                    message_list.append(m)
+                    cursor += size
+                setattr(message_class, field, message_list)
+            else:
+                (m, size) = unpack_functions[t](message[cursor:])
+                cursor += size
+                setattr(message_class, field, m)
+    
+    if not is_field_message:
+        message_class._header = deserialized_header
+        return message_class
+    else:
+        return (message_class, cursor)
+
+# Struct format of the same size of the fixed size types. Unsigned, so that swapping the bytes of a value 
+# (e.g. a NaN) does not change it.
+_swap_formats = {'int8_t' : 'B', 'uint8_t' : 'B', 'int16_t' : 'H', 'uint16_t' : 'H', 'int32_t' : 'I', 'uint32_t' : 'I', 
+                 'int64_t' : 'Q', 'fp32_t' : 'I', 'fp64_t' : 'Q'}
+_swap_header = (struct.Struct('<HHHQHBHB'), struct.Struct('>HHHQHBHB'))
+
+# a dictionary of {message id : layout of its fields}
+_layouts = dict()
+
+def _get_layout(msgid : int) -> Optional[tuple]:
+    '''Returns the layout of the fields of the given message id, or None if it is not known. That is, in order: 
+    a (little endian struct, big endian struct) pair for each run of fixed size fields, the size of each run 
+    of single byte fields (nothing to swap) and the type of each variable size field. Cached.'''
+    layout = _layouts.get(msgid, None)
+    if layout is None:
+        message_class = _get_message_class(msgid)
+        if message_class is None:
+            return None
+        layout = []
+        run = ''
+        for t in message_class[1] + (None,):
+            if t in _swap_formats:
+                run += _swap_formats[t]
+                continue
+            if run.strip('B') != '':
+                layout.append((struct.Struct('<' + run), struct.Struct('>' + run)))
+            elif run != '':
+                layout.append(len(run))
+            run = ''
+            if t is not None:
+                layout.append(t)
+        layout = tuple(layout)
+        _layouts[msgid] = layout
+    return layout
+
+def _swap_uint16(buffer : bytearray, cursor : int, from_big : bool) -> int:
+    value = int.from_bytes(buffer[cursor:cursor + 2], byteorder='big' if from_big else 'little')
+    buffer[cursor], buffer[cursor + 1] = buffer[cursor + 1], buffer[cursor]
+    return value
+
+def _swap_inline(buffer : bytearray, cursor : int, from_big : bool) -> int:
+    '''Swaps an inline message (its id and fields) and returns the position after it.'''
+    msgid = _swap_uint16(buffer, cursor, from_big)
+    cursor += 2
+    if msgid == 65535:
+        return cursor
+    layout = _get_layout(msgid)
+    if layout is None:
+        raise KeyError(f'Cannot convert an unknown inlined message (no information about the size). Add message id {msgid} to extract list')
+    return _swap_fields(buffer, cursor, layout, from_big)
+
+def _swap_fields(buffer : bytearray, cursor : int, layout : tuple, from_big : bool) -> int:
+    '''Swaps, in place, the fields described by layout, starting at cursor, and returns the position after them.'''
+    (src, dst) = (1, 0) if from_big else (0, 1)
+    for op in layout:
+        if type(op) is tuple:
+            size = op[src].size
+            buffer[cursor:cursor + size] = op[dst].pack(*op[src].unpack_from(buffer, cursor))
+            cursor += size
+        elif type(op) is int:
+            cursor += op
+        elif op == 'rawdata' or op == 'plaintext':
+            cursor += 2 + _swap_uint16(buffer, cursor, from_big)
+        elif op == 'message':
+            cursor = _swap_inline(buffer, cursor, from_big)
+        else:
+            # message-list
+            n = _swap_uint16(buffer, cursor, from_big)
+            cursor += 2
+            for _ in range(n):
+                cursor = _swap_inline(buffer, cursor, from_big)
+    return cursor
+
+def convert_endianness(message : bytes, is_big_endian : bool) -> bytes:
+    '''Converts a serialized message (with its CRC already checked) to the given endianness, without decoding it:
+    the bytes of the header, fields, length prefixes and inline messages are swapped according to the layout of
+    the message and the CRC is recomputed. Messages already in the given endianness are returned as they are.
+    
+    Raises KeyError if the message (or one of its inline messages) is not known.'''
+    from_big = int.from_bytes(message[:2], byteorder='big') == _sync_number
+    if not from_big and int.from_bytes(message[:2], byteorder='little') != _sync_number:
+        raise ValueError('Message does not start with a sync number.')
+    if from_big == is_big_endian:
+        return bytes(message)
+    
+    buffer = bytearray(message)
+    (src, dst) = (1, 0) if from_big else (0, 1)
+    header = _swap_header[src].unpack_from(buffer, 0)
+    buffer[:20] = _swap_header[dst].pack(*header)
+    
+    layout = _get_layout(header[1])
+    if layout is None:
+        raise KeyError(f'Cannot convert an unknown message (no information about its fields). Add message id {header[1]} to extract list')
+    if _swap_fields(buffer, 20, layout, from_big) != len(buffer) - 2:
+        raise ValueError(f'The size of message {header[1]} does not match its fields.')
+    
+    buffer[-2:] = core.CRC16IMB(buffer[:-2]).to_bytes(2, byteorder='big' if is_big_endian else 'little')
+    return bytes(buffer)
+
 class immutable_attr():
     '''Describes an immutable attribute. The type should be already known at run time, that is,
     included in the class attribute definition of the message (and therefore, it does not need
     to be type checked).
     Additionally, to prevent accidental modification of python mutable types, which may lead to 
-    an inconsistent state, it checks whether the attribute is of a immutable type before 
-    returning the (reference of) the desired object and if the object is mutable, it returns a 
-    deep copy.'''
+    an inconsistent state, lists are returned as tuples.'''
 
     def __init__(self, doc : str) -> None:
         self.__doc__ = doc
@@ -224,10 +629,10 @@ class immutable_attr():
         if instance is None: #some hacky thing to allow docstrings
             return self
 
-        if isinstance(getattr(instance, self._name), (int, float, str, bool, tuple)):
-            return getattr(instance, self._name)
-        else:
-            return copy.deepcopy(getattr(instance, self._name))
+        value = getattr(instance, self._name)
+        if isinstance(value, list):
+            return tuple(value)
+        return value
 
     def __set__(self, owner : Any, value : Any):
         raise AttributeError('Attribute \'{}\' of {} cannot be modified'.format(self._name, type(owner)))
@@ -239,9 +644,9 @@ class mutable_attr():
     '''Describes a mutable attribute. The type should be already known at run time, that is,
     included in the class attribute definition of the message.
     Additionally, to prevent accidental modification of python mutable types, which may lead to 
-    an inconsistent state, it checks whether the attribute is of a immutable type before 
-    returning the (reference of) the desired object and if the object is mutable, it returns a 
-    deep copy (new and different reference).
+    an inconsistent state, messages are frozen when they are assigned to a field and message-lists
+    are stored as tuples (of frozen messages). Therefore, the getter returns the stored reference
+    and no copy is made on access. A frozen message can be copied with .copy() to be modified.
     Since it can still be re-assigned, it will be type checked when this operation is carried out.
 
     Realization: Inside a message: all attributes are immutable, fields attributes are immutable
@@ -253,94 +658,135 @@ class mutable_attr():
     anyway, since this might give better error messages, but it is, all in all, pointless.
     '''
 
-    def __init__(self, field_def : dict, doc : str) -> None:
+    def __init__(self, field_def : dict, doc : str, enum_class : Any = None) -> None:
         self._field_def = field_def
+        self._enum_class = enum_class
         self.__doc__ = doc
 
     def __set_name__(self, owner : Any, name : str):
         self._priv_name = '_' + name
         self._owner = owner
 
+        enum_class = self._enum_class
+        if enum_class is None and self._field_def.get('unit', None) in ['Enumerated', 'Bitfield']:
+            # Not given by the generated class. If 'enum-def' (or 'bitfield-def') exists, it refers to a 
+            # global definition; get class from file. Else, get definition from owner class
+            if self._field_def.get('unit', None) == 'Enumerated':
+                enum_def = self._field_def.get('enum-def', None)
+                enum_class = getattr(imc_enums, enum_def) if enum_def else getattr(owner, name.upper())
+            else:
+                bitdef = self._field_def.get('bitfield-def', None)
+                enum_class = getattr(imc_bitf, bitdef) if bitdef else getattr(owner, name.upper())
+        
+        self._validate = _compile_validator(name, self._field_def, enum_class)
+
     def __get__(self, instance : Any, owner : Any) -> Any:
         if instance is None: #some hacky thing to allow docstrings
             return self
 
-        # return bare attribute if it is immutable.
-        if isinstance(getattr(instance, self._priv_name), (int, float, str, bool, tuple)):
-            return getattr(instance, self._priv_name)
-        else:
-            return copy.deepcopy(getattr(instance, self._priv_name))
+        # Stored values are either immutable or frozen. Return bare attribute.
+        return getattr(instance, self._priv_name)
 
     def __set__(self, obj : Any, value : Any) -> None:
         '''Performs type and boundary checks and throws exceptions'''
-        set_value = value
-        attribute_type = imc_types.get(self._field_def.get('type', None), None)
-
-        if not attribute_type:
-            raise KeyError('Could not find a type declaration for {} in given IMC definition'.format(self._priv_name[1:]))
+        if getattr(obj, '_frozen', False):
+            raise AttributeError('Cannot assign to \'{}\': message \'{}\' is frozen because it is contained in another message. Use .copy() to get a mutable copy.'.format(
+                self._priv_name[1:], obj.Attributes.abbrev))
+        
+        # check the size (or crop the object at serialization?)
+        setattr(obj, self._priv_name, self._validate(value))
 
-        # Special and only case of upcasting internally allowed.
-        if isinstance(set_value, int) and attribute_type == float:
-            set_value = float(set_value)
+def _compile_validator(name : str, field_def : dict, enum_class : Any) -> Callable[[Any], Any]:
+    '''Builds the function that checks (and converts) a value before it is assigned to the field 'name'.
+    
+    Everything that can be known from the field definition (type, bounds, enumeration/bitfield class,
+    message-type of list elements) is resolved here, once, when the message class is created, and bound
+    to the returned function, so that an assignment only performs the checks that apply to the field.
 
-        if isinstance(set_value, attribute_type):
-            '''Obs: Should type casting be implemented? eg.: float -> int
-            Type casting/coercion will not be implemented to avoid reinforcing bad
-            practices and increase transparency.
-            
-            On a 2nd thought, we may allow SOME upcasting, in particular, int -> float'''
-            
-            # if it is a list, check its elements types.
-            if isinstance(set_value, imc_types['message-list']):
-                
-                for t in set_value: # type: ignore
-                    # Check data type
-                    if not isinstance(t, imc_types['message']):
-                        raise ValueError('Cannot assign {} to attribute \'{}\'. Expected: {} of {}'.format(
-                        type(t), self._priv_name[1:], imc_types[self._field_def['type']], 
-                        imc_types['message']))
-                    
-                    # (I have to check the message group?)
-                    # Check message-type 
-                    if  self._field_def.get('message-type', None) is not None \
-                                    and t.Attributes.abbrev != self._field_def.get('message-type', None):
-                        raise ValueError('Cannot have {} in the list of attribute \'{}\'. Expected: {} of messages of type \'{}\''.format(
-                        type(t), self._priv_name[1:], imc_types[self._field_def['type']],
-                        self._field_def.get('message-type', None)))
-
-            # if it is field, check its validity, according to the IMC XML:
-            if 'min' in self._field_def:
-                if set_value < self._field_def['min']:
-                    raise ValueError('The minimum value for attribute {} is {}. Cannot assign {}.'.format(
-                        self._priv_name[1:], self._field_def['min'], set_value
-                    ))
-
-            if 'max' in self._field_def:
-                if set_value > self._field_def['max']:
-                    raise ValueError('The maximum value for attribute \'{}\' is {}. Cannot assign {}.'.format(
-                        self._priv_name[1:], self._field_def['max'], set_value
-                    ))
-            
-            # Check if its enumerated or bitfield
-            if self._field_def.get('unit', None) == 'Enumerated':
-                # Tries to get definition from the owner class. If 'enum-def' exists, it refers to a 
-                # global definition; returns None, otherwise
-                enum_def = self._field_def.get('enum-def', None) 
-                
-                # if it is global, get class from file. Else, get definition from owner class
-                enum_def = getattr(imc_enums, enum_def) if enum_def else getattr(self._owner, self._priv_name[1:].upper())
+    Obs: Should type casting be implemented? eg.: float -> int
+    Type casting/coercion will not be implemented to avoid reinforcing bad
+    practices and increase transparency.
+    
+    On a 2nd thought, we may allow SOME upcasting, in particular, int -> float
+    '''
+    attribute_type = imc_types.get(field_def.get('type', None), None)
 
-                set_value = enum_def(set_value)
+    if not attribute_type:
+        def missing_type(value : Any) -> Any:
+            raise KeyError('Could not find a type declaration for {} in given IMC definition'.format(name))
+        return missing_type
 
-            if self._field_def.get('unit', None) == 'Bitfield':
-                bitdef = self._field_def.get('bitfield-def', None)
-                
-                bitdef = getattr(imc_bitf, bitdef) if bitdef else getattr(self._owner, self._priv_name[1:].upper())
+    def wrong_type(value : Any) -> AttributeError:
+        return AttributeError('Cannot assign {} to {}. Expected: {}'.format(type(value), name, attribute_type))
 
-                set_value = bitdef(set_value)
+    if attribute_type is imc_types['message-list']:
+        message_class = imc_types['message']
+        message_type = field_def.get('message-type', None)
 
-            # check the size (or crop the object at serialization?)
-            setattr(obj, self._priv_name, set_value)
-        else:
-            raise AttributeError('Cannot assign {} to {}. Expected: {}'.format(
-                type(set_value), self._priv_name[1:], imc_types[self._field_def['type']]))
+        def validate_message_list(value : Any) -> Any:
+            # message-lists are stored as tuples, so accept them as well
+            if not isinstance(value, (list, tuple)):
+                raise wrong_type(value)
+            
+            # check its elements types.
+            for t in value:
+                if not isinstance(t, message_class):
+                    raise ValueError('Cannot assign {} to attribute \'{}\'. Expected: {} of {}'.format(
+                        type(t), name, attribute_type, message_class))
+                
+                # (I have to check the message group?)
+                if message_type is not None and t.Attributes.abbrev != message_type:
+                    raise ValueError('Cannot have {} in the list of attribute \'{}\'. Expected: {} of messages of type \'{}\''.format(
+                        type(t), name, attribute_type, message_type))
+            
+            return _frozen_copy_list(value)
+        return validate_message_list
+
+    if attribute_type is imc_types['message']:
+        def validate_message(value : Any) -> Any:
+            if not isinstance(value, attribute_type):
+                raise wrong_type(value)
+            return _frozen_copy(value)
+        return validate_message
+    
+    # if it is field, check its validity, according to the IMC XML:
+    min_value = field_def.get('min', None)
+    max_value = field_def.get('max', None)
+
+    if attribute_type is float:
+        def validate_float(value : Any) -> Any:
+            # Special and only case of upcasting internally allowed.
+            if isinstance(value, int):
+                value = float(value)
+            elif not isinstance(value, float):
+                raise wrong_type(value)
+            
+            if min_value is not None and value < min_value:
+                raise ValueError('The minimum value for attribute {} is {}. Cannot assign {}.'.format(name, min_value, value))
+            if max_value is not None and value > max_value:
+                raise ValueError('The maximum value for attribute \'{}\' is {}. Cannot assign {}.'.format(name, max_value, value))
+            return value
+        return validate_float
+
+    if min_value is None and max_value is None and enum_class is None:
+        # plaintext, rawdata and unbounded integers
+        def validate_type(value : Any) -> Any:
+            if not isinstance(value, attribute_type):
+                raise wrong_type(value)
+            return value
+        return validate_type
+
+    def validate_bounded(value : Any) -> Any:
+        if not isinstance(value, attribute_type):
+            raise wrong_type(value)
+        
+        if min_value is not None and value < min_value:
+            raise ValueError('The minimum value for attribute {} is {}. Cannot assign {}.'.format(name, min_value, value))
+        if max_value is not None and value > max_value:
+            raise ValueError('The maximum value for attribute \'{}\' is {}. Cannot assign {}.'.format(name, max_value, value))
+        
+        # Check if its enumerated or bitfield
+        if enum_class is not None:
+            value = enum_class(value)
+        return value
+    return validate_bounded
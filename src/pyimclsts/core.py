@@ -18,8 +18,17 @@ import ipaddress as _ipaddress
 
 import struct as _struct
 import asyncio as _asyncio
+import os as _os
+import time as _time
+import gzip as _gzip
+import bisect as _bisect
+import itertools as _itertools
+import collections as _collections
+import threading as _threading
+import queue as _queue
+import multiprocessing as _multiprocessing
 
-from typing import Any
+from typing import Any, Optional
 
 # be = Big Endian, le = Little Endian
 
@@ -191,6 +200,10 @@ class base_IO_interface:
         
     async def write(self, byte_string : bytes) -> None:
         raise NotImplementedError
+
+    async def write_many(self, byte_strings : list) -> None:
+        '''Writes several byte strings at once. By default, joins them and calls write() once.'''
+        await self.write(b''.join(byte_strings))
     
     async def close(self) -> None:
         raise NotImplementedError
@@ -199,22 +212,91 @@ class file_interface(base_IO_interface):
     '''
         A minimal implementation of a file interface. Receives an input
         file name and (optionally) an output file name, to which it appends.
+
+        The input file is read in blocks of block_size bytes by a background thread, which keeps up to 
+        read_ahead blocks ready, so that disk reads do not block the event loop and overlap with the 
+        processing of the previous block. read_ahead = 0 reads the file directly (blocking) instead.
     '''
-    __slots__ = ['_input', '_output', '_o', '_i']
+    __slots__ = ['_input', '_output', '_o', '_i', '_block_size', '_read_ahead', '_blocks', '_block', '_pos', '_thread', '_keep_reading']
 
-    def __init__(self, input : Any = None, output : Any = None) -> None:
+    def __init__(self, input : Any = None, output : Any = None, *, block_size : int = 1 << 20, read_ahead : int = 2) -> None:
         self._input = input
         self._output = output
+        self._block_size = block_size
+        self._read_ahead = read_ahead
+        self._thread = None
 
     async def open(self) -> None:
+        loop = _asyncio.get_running_loop()
         self._o = open(self._output, 'ab') if self._output is not None else None
-        self._i = open(self._input, 'rb')
+        self._i = await loop.run_in_executor(None, open, self._input, 'rb')
+        
+        if self._read_ahead > 0:
+            # blocks read by the thread (b'' at the end of the file, or the exception that stopped it)
+            self._blocks = _queue.Queue(self._read_ahead)
+            self._block = b''
+            self._pos = 0
+            self._keep_reading = True
+            self._thread = _threading.Thread(target=self._read_blocks, name='file_interface', daemon=True)
+            self._thread.start()
     
+    def _read_blocks(self) -> None:
+        '''Executed by the background thread.'''
+        block = None
+        while self._keep_reading and block != b'':
+            try:
+                block = self._i.read(self._block_size)
+            except Exception as e:
+                block = e
+            # wait for room, but check from time to time whether it has been closed
+            while self._keep_reading:
+                try:
+                    self._blocks.put(block, timeout=0.1)
+                    break
+                except _queue.Full:
+                    pass
+            if isinstance(block, Exception):
+                return
+
+    async def _next_block(self) -> bool:
+        '''Takes the next block read by the thread. Returns False at the end of the file.'''
+        try:
+            block = self._blocks.get_nowait()
+        except _queue.Empty:
+            block = await _asyncio.get_running_loop().run_in_executor(None, self._blocks.get)
+        if isinstance(block, Exception):
+            raise block
+        if block == b'':
+            # keep signalling the end of the file to subsequent reads
+            self._blocks.put(block)
+            return False
+        (self._block, self._pos) = (block, 0)
+        return True
+
     async def read(self, n_bytes : int) -> bytes:
-        r = self._i.read(n_bytes)
-        if r == b'':
+        if self._read_ahead <= 0:
+            r = self._i.read(n_bytes)
+            if r == b'':
+                raise EOFError('End of File reached')
+            return r
+
+        pos = self._pos
+        if pos + n_bytes <= len(self._block):
+            self._pos = pos + n_bytes
+            return self._block[pos:pos + n_bytes]
+        
+        # the bytes span several blocks
+        chunks = []
+        while n_bytes > 0:
+            if self._pos >= len(self._block) and not await self._next_block():
+                break
+            chunk = self._block[self._pos:self._pos + n_bytes]
+            self._pos += len(chunk)
+            n_bytes -= len(chunk)
+            chunks.append(chunk)
+        if not chunks:
             raise EOFError('End of File reached')
-        return r
+        return b''.join(chunks)
         
     async def write(self, byte_string : bytes) -> None:
         if self._o is not None:
@@ -223,6 +305,15 @@ class file_interface(base_IO_interface):
     async def close(self) -> None:
         if self._o is not None:
             self._o.close()
+        if self._thread is not None:
+            self._keep_reading = False
+            await _asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+            self._thread = None
+            # wake up a read that may be waiting for a block
+            try:
+                self._blocks.put_nowait(b'')
+            except _queue.Full:
+                pass
         self._i.close()
 
 class tcp_interface(base_IO_interface):
@@ -248,7 +339,198 @@ class tcp_interface(base_IO_interface):
     async def write(self, byte_string : bytes) -> None:
         self._writer.write(byte_string)
         await self._writer.drain()
+
+    async def write_many(self, byte_strings : list) -> None:
+        '''Gathers the byte strings in a single write (and a single drain).'''
+        self._writer.writelines(byte_strings)
+        await self._writer.drain()
     
     async def close(self) -> None:
         self._writer.close()
         await self._writer.wait_closed()
+
+class lsf_recorder:
+    '''
+        Records frames (e.g. the valid frames received by a message bus, see message_bus.record) to log files.
+
+        append() only stores a reference to the frame. A background thread joins the stored frames and writes 
+        them every flush_interval seconds, or as soon as buffer_size bytes are waiting, so that the (slow) file
+        operations do not block the caller.
+
+        If max_size (bytes) or max_age (seconds) are given, the frames are written to a sequence of files,
+        <path without extension>-0000<extension>, -0001 and so on, and a new file is started when the current one
+        would exceed max_size (uncompressed) or is older than max_age. If compress (1 to 9) is given, files are
+        gzipped on the fly with that level. fsync is one of 'never', 'rotate' (when a file is closed) or 'flush' (after each write).
+    '''
+    __slots__ = ['_path', '_max_size', '_max_age', '_compress', '_fsync', '_buffer_size', '_flush_interval',
+                 '_frames', '_unsignalled', '_event', '_thread', '_keep_running', '_accepting', '_counters']
+
+    _fsync_policies = ('never', 'rotate', 'flush')
+    # indices of the counters. Each one is written by a single thread: _REJECTED (frames appended while
+    # the recorder is not running) by the one that appends the frames, the others by the writer thread.
+    _FRAMES, _BYTES, _FILES, _ERRORS, _DROPPED, _REJECTED = range(6)
+
+    def __init__(self, path : str, *, max_size : Optional[int] = None, max_age : Optional[float] = None, 
+                    compress : Optional[int] = None, fsync : str = 'rotate', buffer_size : int = 1 << 20, 
+                    flush_interval : float = 1) -> None:
+        if fsync not in self._fsync_policies:
+            raise ValueError(f'Unknown fsync policy \'{fsync}\'. Expected one of {self._fsync_policies}.')
+        self._path = path
+        self._max_size = max_size
+        self._max_age = max_age
+        self._compress = compress
+        self._fsync = fsync
+        self._buffer_size = buffer_size
+        self._flush_interval = flush_interval
+        # Shared memory, so that the counters of a recorder running in a child process can be read
+        self._counters = _multiprocessing.Array('Q', 6, lock=False)
+        self._thread = None
+        self._accepting = False
+
+    def __repr__(self) -> str:
+        return f'lsf_recorder({self._path!r}, max_size={self._max_size}, max_age={self._max_age}, compress={self._compress}, fsync={self._fsync!r})'
+
+    def _file_name(self, index : int) -> str:
+        if self._max_size is None and self._max_age is None:
+            name = self._path
+        else:
+            root, ext = _os.path.splitext(self._path)
+            name = f'{root}-{index:04d}{ext}'
+        if self._compress is not None and not name.endswith('.gz'):
+            name += '.gz'
+        return name
+
+    def start(self) -> None:
+        '''Starts the background thread. Must be called in the process that appends the frames.'''
+        # A deque, because append and popleft are thread-safe
+        self._frames = _collections.deque()
+        self._unsignalled = 0
+        self._event = _threading.Event()
+        self._keep_running = True
+        self._accepting = True
+        self._thread = _threading.Thread(target=self._writer_loop, name='lsf_recorder', daemon=True)
+        self._thread.start()
+
+    def append(self, frame : bytes) -> None:
+        '''Stores a frame to be written. Frames are dropped (and counted) if the recorder is not running.'''
+        if not self._accepting:
+            self._counters[self._REJECTED] += 1
+            return
+        self._frames.append(frame)
+        self._unsignalled += len(frame)
+        if self._unsignalled >= self._buffer_size:
+            self._unsignalled = 0
+            self._event.set()
+
+    def stop(self) -> None:
+        '''Writes the remaining frames, closes the file and stops the background thread.'''
+        if self._thread is not None:
+            self._keep_running = False
+            self._event.set()
+            self._thread.join()
+            self._thread = None
+
+    def counters(self) -> dict:
+        '''Returns the number of frames and bytes written, of files opened, of failed file operations and of 
+        frames that were not written.'''
+        counters = self._counters[:]
+        return {'frames' : counters[self._FRAMES], 'bytes' : counters[self._BYTES], 'files' : counters[self._FILES], 
+                'errors' : counters[self._ERRORS], 'dropped' : counters[self._DROPPED] + counters[self._REJECTED]}
+
+    def _writer_loop(self) -> None:
+        '''Executed by the background thread.'''
+        try:
+            self._write_frames()
+        except Exception as e:
+            self._counters[self._ERRORS] += 1
+            print(f'Warning: lsf_recorder has stopped: {e!r}')
+        finally:
+            # Stop buffering frames that no one will write
+            self._accepting = False
+            self._counters[self._DROPPED] += len(self._frames)
+            self._frames.clear()
+
+    def _write_frames(self) -> None:
+        frames = self._frames
+        counters = self._counters
+        index = 0
+        file = None
+        (raw, size, opened_at) = (None, 0, 0.0)
+
+        def close() -> None:
+            try:
+                if file is not raw:
+                    # writes the gzip trailer, but does not close raw
+                    file.close()
+                raw.flush()
+                if self._fsync != 'never':
+                    _os.fsync(raw.fileno())
+            except OSError as e:
+                counters[self._ERRORS] += 1
+                print(f'Warning: lsf_recorder could not close {raw.name}: {e}')
+            finally:
+                raw.close()
+
+        while True:
+            self._event.wait(self._flush_interval)
+            self._event.clear()
+            keep_running = self._keep_running
+            
+            pending = [frames.popleft() for _ in range(len(frames))]
+            if file is not None and self._max_age is not None and _time.monotonic() - opened_at >= self._max_age:
+                close()
+                file = None
+            
+            while pending:
+                if file is None:
+                    name = self._file_name(index)
+                    try:
+                        if _os.path.dirname(name):
+                            _os.makedirs(_os.path.dirname(name), exist_ok=True)
+                        raw = open(name, 'ab')
+                    except OSError as e:
+                        # Try again on the next flush
+                        counters[self._ERRORS] += 1
+                        counters[self._DROPPED] += len(pending)
+                        print(f'Warning: lsf_recorder could not open {name}, {len(pending)} frames were dropped: {e}')
+                        break
+                    file = _gzip.GzipFile(fileobj=raw, mode='ab', compresslevel=self._compress) if self._compress is not None else raw
+                    (size, opened_at) = (0, _time.monotonic())
+                    index += 1
+                    counters[self._FILES] += 1
+                
+                if self._max_size is not None:
+                    # frames that fit in the current file (at least one, so that a file is never left empty)
+                    n = _bisect.bisect_right(list(_itertools.accumulate(map(len, pending))), self._max_size - size)
+                    n = max(n, 1) if size == 0 else n
+                else:
+                    n = len(pending)
+                
+                if n > 0:
+                    chunk = b''.join(pending[:n])
+                    try:
+                        file.write(chunk)
+                        if self._fsync == 'flush':
+                            file.flush()
+                            if raw is not file:
+                                raw.flush()
+                            _os.fsync(raw.fileno())
+                        counters[self._FRAMES] += n
+                        counters[self._BYTES] += len(chunk)
+                    except OSError as e:
+                        counters[self._ERRORS] += 1
+                        counters[self._DROPPED] += n
+                        print(f'Warning: lsf_recorder could not write {n} frames to {self._file_name(index - 1)}: {e}')
+                    size += len(chunk)
+                    del pending[:n]
+                
+                if pending:
+                    # the current file is full
+                    close()
+                    file = None
+            
+            if not keep_running:
+                break
+        
+        if file is not None:
+            close()
@@ -58,8 +58,10 @@ class Unknown(_base.base_message):
             
             # footer:
             \'\'\'Calculates CRC-16 IBM of a bit string\'\'\'
-            self._footer = _core.CRC16IMB(s_message)
-            s_message = s_message + serial_functions['uint16_t'](self._footer)
+            footer = _core.CRC16IMB(s_message)
+            if not getattr(self, '_frozen', False):
+                self._footer = footer
+            s_message = s_message + serial_functions['uint16_t'](footer)
 
             return s_message
         return serial_functions['uint16_t'](self._Attributes.id) + s_fields
@@ -85,6 +87,8 @@ def hardcode_message_extractor(message : dict, templates_namespace : str, messag
     ws = '    '
 
     local_enumeration = []
+    enum_lookups = []
+    decoded_values = []
     priv_attrib = ['_Attributes', '_header', '_footer']
     attributes = []
     mutable_attrib = []
@@ -104,7 +108,13 @@ def hardcode_message_extractor(message : dict, templates_namespace : str, messag
     
     for field in message.get('fields', []):
         priv_attrib.append('_' + field)
-        initialization_values.append(2*ws + 'self.' + priv_attrib[-1] + ' = ' + field + '\n')
+        # Messages contained in another message are frozen copies (message-lists are stored as tuples)
+        if message['fields'][field]['type'] == 'message':
+            initialization_values.append(2*ws + 'self.' + priv_attrib[-1] + ' = ' + namespace + '_frozen_copy(' + field + ')\n')
+        elif message['fields'][field]['type'] == 'message-list':
+            initialization_values.append(2*ws + 'self.' + priv_attrib[-1] + ' = ' + namespace + '_frozen_copy_list(' + field + ')\n')
+        else:
+            initialization_values.append(2*ws + 'self.' + priv_attrib[-1] + ' = ' + field + '\n')
         constructor_args.append(field + ' = None')
         
         # All fields' contents are mutable
@@ -117,12 +127,34 @@ def hardcode_message_extractor(message : dict, templates_namespace : str, messag
             else:
                 description = description + ' (Local).'
 
-        mutable_attrib.append('{ws}{field} = {namespace}mutable_attr({definition}, \"{description}\")\n{ws}\'\'\'{description} Type: {type}\'\'\'\n'.format(
+        # Bind the enumeration/bitfield class to the descriptor: the local class (defined above in
+        # the class body) or the global one, so that it is not looked up on every assignment.
+        enum_class = None
+        if field_attr.get('unit', None) == 'Enumerated':
+            enum_class = namespace + 'imc_enums.' + field_attr['enum-def'] if field_attr.get('enum-def', None) else field.upper()
+        elif field_attr.get('unit', None) == 'Bitfield':
+            enum_class = namespace + 'imc_bitf.' + field_attr['bitfield-def'] if field_attr.get('bitfield-def', None) else field.upper()
+
+        # Values of the trusted constructor (_from_decoded), positionally
+        index = len(decoded_values)
+        if enum_class:
+            enum_lookups.append('{ws}_{field}_lookup = staticmethod({namespace}_enum_lookup({enum_class}))\n'.format(
+                ws = ws, field = field, namespace = namespace, enum_class = enum_class))
+            decoded_values.append(2*ws + 'message._{field} = cls._{field}_lookup(values[{index}])\n'.format(field = field, index = index))
+        elif message['fields'][field]['type'] == 'message':
+            decoded_values.append(2*ws + 'message._{field} = {namespace}_freeze(values[{index}])\n'.format(field = field, namespace = namespace, index = index))
+        elif message['fields'][field]['type'] == 'message-list':
+            decoded_values.append(2*ws + 'message._{field} = {namespace}_freeze_list(values[{index}])\n'.format(field = field, namespace = namespace, index = index))
+        else:
+            decoded_values.append(2*ws + 'message._{field} = values[{index}]\n'.format(field = field, index = index))
+
+        mutable_attrib.append('{ws}{field} = {namespace}mutable_attr({definition}, \"{description}\"{enum_class})\n{ws}\'\'\'{description} Type: {type}\'\'\'\n'.format(
             ws = ws,
             field = field,
             namespace = namespace,
             definition = { k:v for k, v in field_attr.items() if k not in ['description', 'values']},
             description = description,
+            enum_class = ', enum_class = ' + enum_class if enum_class else '',
             type = message['fields'][field]['type']))
 
         # Determine if its a local declaration of a Enumeration/bitfield
@@ -138,6 +170,8 @@ def hardcode_message_extractor(message : dict, templates_namespace : str, messag
     local_enumeration = ''.join(local_enumeration)
     attributes = ', '.join(attributes)
     mutable_attrib = ''.join(mutable_attrib)
+    enum_lookups = ''.join(enum_lookups)
+    decoded_values = ''.join(decoded_values)
     initialization_values = ''.join(initialization_values)
     constructor_args = ', '.join(constructor_args)
 
@@ -163,12 +197,22 @@ class {name}({namespace}base_message):
     __slots__ = {priv_attrib}
     Attributes = {namespace}MessageAttributes({attributes})
 
-{mutable_attrib}
+{mutable_attrib}{enum_lookups}
     def __init__(self, {constructor_args}):
         \'\'\'Class constructor
         
         {description}\'\'\'
 {constructor_values}
+    @classmethod
+    def _from_decoded(cls, values : tuple, message : '{name}' = None) -> '{name}':
+        \'\'\'Trusted constructor, used by the deserializer. Skips the descriptors' checks.
+
+        values contains the decoded fields in the order of Attributes.fields. Enumerations and
+        bitfields are converted to their classes (as when the fields are assigned). If message
+        is given, its fields are refilled in place instead of creating a new message.\'\'\'
+        if message is None:
+            message = cls.__new__(cls)
+{decoded_values}        return message
 '''.format(namespace = namespace,
 name = name,
 description = description,
@@ -177,6 +221,8 @@ priv_attrib = priv_attrib,
 attributes = attributes,
 mutable_attrib = mutable_attrib, 
 constructor_values = initialization_values,
+enum_lookups = enum_lookups,
+decoded_values = decoded_values,
 constructor_args = constructor_args)
     
     return class_def
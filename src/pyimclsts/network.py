@@ -4,12 +4,17 @@
 '''
 from typing import Callable, Union, Optional, Tuple, Any
 import functools as _functools
+import json as _json
+import collections as _collections
+import heapq as _heapq
 import inspect as _inspect
 import types as _types
 
 import multiprocessing as _multiprocessing
+import concurrent.futures as _futures
 import asyncio as _asyncio
 import time as _time
+import struct as _struct
 
 import importlib.util as _import
 import sys as _sys
@@ -26,98 +31,9 @@ _pg = _import.module_from_spec(_spec)
 _sys.modules[_module_name] = _pg
 _spec.loader.exec_module(_pg)
 
-def unpack(message : bytes, *, is_big_endian : Optional[bool] = None, is_field_message : bool = False, fast_mode : bool = False) -> Any:
-    '''Expects a serializable (= exactly long (header + fields + CRC)) string of bits whose CRC has already been checked
-    
-    Fast mode skips all type checking performed by the descriptor by directly invoking the constructor.
-    '''
-    if is_big_endian is None:
-        is_big_endian = int.from_bytes(message[:2], byteorder='big') == _pg._base._sync_number
-        # Note: is_big_endian is a function parameter to enable recursion
-    
-    unpack_functions = _core.unpack_functions_big if is_big_endian else _core.unpack_functions_little
-    cursor = 0
-    
-    if not is_field_message:
-        # deserialize header
-        (m, size) = unpack_functions['header'](message[cursor:])
-        deserialized_header = _pg._base.header_data(*m)
-        cursor += size
-    
-        msgid = deserialized_header.mgid
-        if msgid not in _pg.messages._message_ids:
-            unknown_msg = _pg.messages.Unknown(msgid, contents = message[cursor:-2], endianness = is_big_endian)
-            unknown_msg._header = deserialized_header
-            return unknown_msg
-    else:
-        msgid = unpack_functions['uint16_t'](message[cursor:cursor+2])[0]
-        cursor += 2
-        if msgid not in _pg.messages._message_ids:
-            raise KeyError(f'Cannot parse/unpack an unknown inlined message (no information about the size). Add message id {msgid} to extract list')
-    
-    if fast_mode:
-        # get corresponding class
-        message_class = getattr(_pg.messages, _pg.messages._message_ids.get(msgid, None))
-
-        fields = [(f, getattr(getattr(type(message_class()), f), '_field_def')['type']) for f in message_class().Attributes.fields]
-        arguments = dict()
-        for field, t in fields:
-            if t == 'message':
-                if unpack_functions['uint16_t'](message[cursor:cursor+2])[0] == 65535:
-                    cursor += 2
-                else:
-                    (m, size) = unpack(message[cursor:], is_big_endian=is_big_endian, is_field_message=True, fast_mode=fast_mode)
-                    arguments[field] = m
-                    cursor += size
-            elif t == 'message-list':
-                (n, _) = unpack_functions['uint16_t'](message[cursor:])
-                cursor += 2
-                arguments[field] = []
-                for _ in range(n):
-                    (m, size) = unpack(message[cursor:], is_big_endian=is_big_endian, is_field_message=True, fast_mode=fast_mode)
-                    arguments[field].append(m)
-                    cursor += size
-            else:
-                (m, size) = unpack_functions[t](message[cursor:])
-                arguments[field] = m
-                cursor += size
-        # instantiate class through constructor
-        message_class = message_class(**arguments)
-        
-    else:
-        # instantiate empty class
-        message_class = getattr(_pg.messages, _pg.messages._message_ids.get(msgid, None))()
-
-        # deserialize fields
-        # make a (field, type) tuple list, get information in the descriptor
-        fields = [(f, getattr(getattr(type(message_class), f), '_field_def')['type']) for f in message_class.Attributes.fields]
-        for field, t in fields:
-            if t == 'message':
-                if unpack_functions['uint16_t'](message[cursor:cursor+2])[0] == 65535:
-                    cursor += 2
-                else:
-                    (m, size) = unpack(message[cursor:], is_big_endian=is_big_endian, is_field_message=True, fast_mode=fast_mode)
-                    cursor += size
-                    setattr(message_class, field, m)
-            elif t == 'message-list':
-                (n, _) = unpack_functions['uint16_t'](message[cursor:])
-                cursor += 2
-                message_list = []
-                for _ in range(n):
-                    (m, size) = unpack(message[cursor:], is_big_endian=is_big_endian, is_field_message=True, fast_mode=fast_mode)
-                    message_list.append(m)
-                    cursor += size
-                setattr(message_class, field, message_list)
-            else:
-                (m, size) = unpack_functions[t](message[cursor:])
-                cursor += size
-                setattr(message_class, field, m)
-    
-    if not is_field_message:
-        message_class._header = deserialized_header
-        return message_class
-    else:
-        return (message_class, cursor)
+# Re-export the deserializer and the endianness converter (they live with the generated classes, so that they can use them too, e.g. to be unpickled)
+unpack = _pg._base.unpack
+convert_endianness = _pg._base.convert_endianness
 
 def _get_id_src_src_ent(message : bytes) -> Tuple[int, int, int]:
     src_ent = message[16]
@@ -132,22 +48,535 @@ def _get_id_src_src_ent(message : bytes) -> Tuple[int, int, int]:
         
         return (id, src, src_ent)
 
+# Sync number as it starts little and big endian frames, and the header deserializers (that do not copy the frame)
+_sync_little = _pg._base._sync_number.to_bytes(2, byteorder='little')
+_sync_big = _pg._base._sync_number.to_bytes(2, byteorder='big')
+_header_little = _struct.Struct('<HHHdHBHB').unpack_from
+_header_big = _struct.Struct('>HHHdHBHB').unpack_from
+
+def header_view(frame : bytes) -> _pg._base.header_data:
+    '''Returns the header of a frame (with or without its CRC checked) as a header_data, without decoding 
+    the message. Meant for filters and routing of frames that are forwarded as they are.'''
+    if frame[:2] == _sync_big:
+        return _pg._base.header_data._make(_header_big(frame))
+    return _pg._base.header_data._make(_header_little(frame))
+
 # Re-export some classes:
 
 tcp_interface = _core.tcp_interface
 file_interface = _core.file_interface
+lsf_recorder = _core.lsf_recorder
+
+# Priorities of outgoing messages. Messages of higher priority (lower value) are always sent first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+def _clamp_priority(priority : int) -> int:
+    '''Priorities beyond PRIORITY_HIGH and PRIORITY_LOW are treated as these (and fit in the byte that prefixes 
+    the frames in the pipes).'''
+    return min(max(priority, PRIORITY_HIGH), PRIORITY_LOW)
+
+# Safety related messages skip the queue by default.
+_default_priorities = {getattr(_pg.messages, name).Attributes.id : PRIORITY_HIGH for name in 
+                        ['Abort', 'PlanControl', 'VehicleCommand', 'EmergencyControl'] if hasattr(_pg.messages, name)}
+
+# Counters (and gauges) of the message buses. They are kept in shared memory, so that the counters
+# of the child process of message_bus can be read by the main process.
+_bus_metrics = ('bytes_read', 'frames_read', 'crc_failures', 'bytes_skipped', 'bytes_written', 'frames_written', 'writer_queue')
+_BYTES_READ, _FRAMES_READ, _CRC_FAILURES, _BYTES_SKIPPED, _BYTES_WRITTEN, _FRAMES_WRITTEN, _WRITER_QUEUE = range(len(_bus_metrics))
+
+# Directory to which profiles are written (see _profiler), if not given to the subscriber or message bus
+_profile_env_var = 'PYIMCLSTS_PROFILE'
+
+class _profiler:
+    '''Context manager that profiles the code it runs with cProfile, if a directory is given. The profile is
+    written to <directory>/<role>-<pid>.prof (see pstats, or snakeviz, to read it).'''
+    __slots__ = ['_directory', '_role', '_profile']
+
+    def __init__(self, directory : Optional[str], role : str) -> None:
+        self._directory = directory
+        self._role = role
+        self._profile = None
+
+    def __enter__(self):
+        if self._directory is not None:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if self._profile is not None:
+            self._profile.disable()
+            _os.makedirs(self._directory, exist_ok=True)
+            file_name = _os.path.join(self._directory, f'{self._role}-{_os.getpid()}.prof')
+            self._profile.dump_stats(file_name)
+            print(f'Profile of {self._role} has been written to {file_name}.')
+        return None
+
+def _run_profiled(directory : Optional[str], role : str, target : Callable, *args) -> None:
+    '''Target of the child processes. Runs target(*args) under a _profiler.'''
+    with _profiler(directory, role):
+        target(*args)
+
+def _get_msg_id(msg_id : Union[int, _core.IMC_message, str]) -> int:
+    '''Returns the id of a message given as an int, a message class (or its instance) or its name.'''
+    if isinstance(msg_id, int):
+        return msg_id
+    if isinstance(msg_id, str):
+        msg_id = getattr(_pg.messages, msg_id)
+    return msg_id.Attributes.id
+
+class _priority_queue:
+    '''A queue with a lane (FIFO) per priority. Items are taken from the lane of highest priority (lowest value) 
+    that is not empty. Unlike asyncio.Queue, it is unbounded and can be created outside of an event loop.'''
+    __slots__ = ['_lanes', '_size', '_event']
+
+    def __init__(self, n_lanes : int = PRIORITY_LOW + 1) -> None:
+        self._lanes = [_collections.deque() for _ in range(n_lanes)]
+        self._size = 0
+        # Created by the first consumer that waits
+        self._event = None
+
+    def put_nowait(self, item : Any, priority : int = PRIORITY_NORMAL) -> None:
+        self._lanes[min(max(priority, 0), len(self._lanes) - 1)].append(item)
+        self._size += 1
+        if self._event is not None:
+            self._event.set()
+
+    def get_nowait(self) -> Any:
+        for lane in self._lanes:
+            if lane:
+                self._size -= 1
+                return lane.popleft()
+        raise _asyncio.QueueEmpty
+
+    async def get(self) -> Any:
+        while self._size == 0:
+            if self._event is None:
+                self._event = _asyncio.Event()
+            self._event.clear()
+            await self._event.wait()
+        return self.get_nowait()
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def qsize(self) -> int:
+        return self._size
+
+def _get_id_dst(frame : bytes) -> Tuple[int, int]:
+    if int.from_bytes(frame[:2], byteorder='big') == _pg._base._sync_number:
+        return (int.from_bytes(frame[2:4], byteorder='big'), int.from_bytes(frame[17:19], byteorder='big'))
+    return (int.from_bytes(frame[2:4], byteorder='little'), int.from_bytes(frame[17:19], byteorder='little'))
+
+class _token_bucket:
+    '''Rate limit of outgoing messages: rate messages per second, with bursts of at most burst messages.
+
+    Messages over the limit are handled according to policy:
+        - 'drop': they are discarded;
+        - 'delay': they wait (at most max_pending of them, further messages are dropped) and are sent, in order, 
+        as soon as the limit allows it;
+        - 'conflate': as 'delay', but only the latest message of each (message id, dst, dst_ent) waits.
+    
+    Delayed messages are released by the running event loop. Without one, they are dropped.
+    counters keeps the number of sent, delayed, conflated (replaced by a newer message) and dropped messages.'''
+    __slots__ = ['rate', 'burst', 'policy', 'max_pending', 'counters', '_tokens', '_last', '_pending', '_next_key', '_handle']
+
+    _policies = ('drop', 'delay', 'conflate')
+
+    def __init__(self, rate : float, burst : Optional[float] = None, policy : str = 'drop', max_pending : int = 100) -> None:
+        if policy not in self._policies:
+            raise ValueError(f'Unknown rate limit policy \'{policy}\'. Expected one of {self._policies}.')
+        if not rate > 0:
+            raise ValueError(f'Invalid rate {rate}. Expected a positive number of messages per second (or None to remove the limit).')
+        if burst is not None and not burst >= 1:
+            raise ValueError(f'Invalid burst {burst}. Expected at least 1 message.')
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self.policy = policy
+        self.max_pending = max_pending
+        self.counters = {'sent' : 0, 'delayed' : 0, 'conflated' : 0, 'dropped' : 0}
+        self._tokens = self.burst
+        self._last = _time.monotonic()
+        # a dictionary of {key : (send function, args, kwargs)}, in order of arrival
+        self._pending = dict()
+        self._next_key = 0
+        self._handle = None
+
+    def __repr__(self) -> str:
+        return f'_token_bucket({self.rate}, burst={self.burst}, policy={self.policy!r}, max_pending={self.max_pending})'
+
+    def _refill(self) -> None:
+        now = _time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def submit(self, key : Tuple, send : Callable, args : tuple, kwargs : dict) -> None:
+        '''Calls send(*args, **kwargs) now, later or never, according to the limit. key identifies the message
+        for the 'conflate' policy.'''
+        if not self._pending:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.counters['sent'] += 1
+                send(*args, **kwargs)
+                return
+
+        if self.policy == 'conflate':
+            if key in self._pending:
+                self.counters['conflated'] += 1
+                self._pending[key] = (send, args, kwargs)
+                return
+        elif self.policy == 'delay':
+            key = self._next_key
+            self._next_key += 1
+
+        if self.policy == 'drop' or len(self._pending) >= self.max_pending:
+            self.counters['dropped'] += 1
+            return
+        
+        self._pending[key] = (send, args, kwargs)
+        self.counters['delayed'] += 1
+        if self._handle is None:
+            self._schedule()
+
+    def _schedule(self) -> None:
+        try:
+            loop = _asyncio.get_running_loop()
+        except RuntimeError:
+            self.counters['dropped'] += len(self._pending)
+            self.counters['delayed'] -= len(self._pending)
+            self._pending.clear()
+            return
+        self._handle = loop.call_later(max(1 - self._tokens, 0) / self.rate, self._release)
+
+    def _release(self) -> None:
+        self._handle = None
+        self._refill()
+        while self._pending and self._tokens >= 1:
+            send, args, kwargs = self._pending.pop(next(iter(self._pending)))
+            self._tokens -= 1
+            self.counters['sent'] += 1
+            send(*args, **kwargs)
+        if self._pending:
+            self._schedule()
+
+class _receive_queue:
+    '''Queue of received frames, bounded to maxsize frames (None for no bound). 
+
+    When it is full, a new frame is handled according to the policy of its message id (policies, a dictionary 
+    of {message id : policy}, or policy, for the others):
+        - 'block': waits for space, so that the reader stops reading (backpressure);
+        - 'drop_oldest': the oldest frame of the queue is discarded;
+        - 'conflate': the frame replaces the queued frame of the same (message id, src, src_ent), if any, even 
+        if the queue is not full, and takes its place in the queue. These frames are neither discarded nor 
+        wait: there is at most one of them per (message id, src, src_ent), even beyond maxsize.
+    counters keeps the number of dropped and conflated (replaced) frames.
+
+    If stamp, the time of arrival (time.monotonic()) of the last frame taken from the queue is kept in last_arrival.'''
+    __slots__ = ['_maxsize', '_policy', '_policies', '_frames', '_latest', '_arrivals', '_latest_arrivals', 
+                 '_available', '_space', 'counters', 'last_arrival']
+
+    _policies_names = ('block', 'drop_oldest', 'conflate')
+
+    def __init__(self, maxsize : Optional[int] = 1024, policy : str = 'block', policies : Optional[dict] = None, 
+                    stamp : bool = False) -> None:
+        for p in [policy, *(policies.values() if policies is not None else [])]:
+            if p not in self._policies_names:
+                raise ValueError(f'Unknown overflow policy \'{p}\'. Expected one of {self._policies_names}.')
+        self._maxsize = maxsize
+        self._policy = policy
+        self._policies = {_get_msg_id(k) : v for k, v in policies.items()} if policies is not None else dict()
+        # frames or, when conflated, their (mgid, src, src_ent) key
+        self._frames = _collections.deque()
+        # a dictionary of {(mgid, src, src_ent) : latest frame} of the conflated frames in the queue
+        self._latest = dict()
+        # Times of arrival of the frames (in the same order) and of the conflated frames
+        self._arrivals = _collections.deque() if stamp else None
+        self._latest_arrivals = dict()
+        self.last_arrival = None
+        # Created by the first consumer/producer that waits
+        self._available = None
+        self._space = None
+        self.counters = {'dropped' : 0, 'conflated' : 0}
+
+    def qsize(self) -> int:
+        return len(self._frames)
+
+    def empty(self) -> bool:
+        return not self._frames
+
+    def full(self) -> bool:
+        return self._maxsize is not None and len(self._frames) >= self._maxsize
+
+    def _policy_of(self, frame : bytes) -> str:
+        if not frame:
+            # end of stream is never discarded
+            return 'block'
+        if self._policies:
+            return self._policies.get(_get_id_src_src_ent(frame)[0], self._policy)
+        return self._policy
+
+    def offer(self, frame : bytes, policy : Optional[str] = None) -> bool:
+        '''Adds the frame without waiting. Frames with the 'block' policy are added even if the queue is full,
+        in which case it returns False.'''
+        if policy is None:
+            policy = self._policy_of(frame)
+        
+        arrivals = self._arrivals
+        item = frame
+        if policy == 'conflate':
+            item = _get_id_src_src_ent(frame)
+            if arrivals is not None:
+                self._latest_arrivals[item] = _time.monotonic()
+            if item in self._latest:
+                self._latest[item] = frame
+                self.counters['conflated'] += 1
+                return True
+            self._latest[item] = frame
+
+        full = self.full()
+        if full and policy == 'drop_oldest':
+            dropped = self._frames.popleft()
+            if type(dropped) is tuple:
+                del self._latest[dropped]
+                self._latest_arrivals.pop(dropped, None)
+            if arrivals is not None:
+                arrivals.popleft()
+            self.counters['dropped'] += 1
+            full = False
+        
+        self._frames.append(item)
+        if arrivals is not None:
+            arrivals.append(_time.monotonic())
+        if self._available is not None:
+            self._available.set()
+        return not (full and policy == 'block')
+
+    async def put(self, frame : bytes) -> None:
+        policy = self._policy_of(frame)
+        while policy == 'block' and self.full():
+            if self._space is None:
+                self._space = _asyncio.Event()
+            self._space.clear()
+            await self._space.wait()
+        self.offer(frame, policy)
+
+    def get_nowait(self) -> bytes:
+        if not self._frames:
+            raise _asyncio.QueueEmpty
+        item = self._frames.popleft()
+        if self._space is not None:
+            self._space.set()
+        if self._arrivals is not None:
+            self.last_arrival = self._arrivals.popleft()
+            if type(item) is tuple:
+                self.last_arrival = self._latest_arrivals.pop(item)
+        if type(item) is tuple:
+            return self._latest.pop(item)
+        return item
+
+    async def wait(self) -> None:
+        '''Waits until there is a frame in the queue (without taking it).'''
+        while not self._frames:
+            if self._available is None:
+                self._available = _asyncio.Event()
+            self._available.clear()
+            await self._available.wait()
+
+    async def get(self) -> bytes:
+        await self.wait()
+        return self.get_nowait()
+
+class _lazy_message:
+    '''A received frame that is only decoded when one of the attributes of the message is accessed. The 
+    header (a header_data, with mgid, src, src_ent, etc) is available without decoding it. Any other 
+    attribute is the one of the message, so fields such as id are never taken from the header.'''
+    __slots__ = ['frame', 'header', '_message']
+
+    def __init__(self, frame : bytes, header : _pg._base.header_data) -> None:
+        self.frame = frame
+        self.header = header
+        self._message = None
+
+    def __repr__(self) -> str:
+        return f'_lazy_message(mgid={self.header.mgid}, src={self.header.src}, src_ent={self.header.src_ent}, decoded={self._message is not None})'
+
+    def decode(self) -> _core.IMC_message:
+        '''Returns the decoded message.'''
+        if self._message is None:
+            self._message = unpack(self.frame, fast_mode=True)
+        return self._message
+
+    def __getattr__(self, name : str) -> Any:
+        return getattr(self.decode(), name)
+
+_decode_modes = ('eager', 'lazy', 'raw')
+
+def _frame_filter(msg_ids : Optional[list], src : Optional[int], src_ent : Optional[int], decode : str) -> Callable[[bytes], Any]:
+    '''Returns a function that returns the frame (decoded according to decode) if it passes the filters, 
+    or None otherwise.'''
+    if decode not in _decode_modes:
+        raise ValueError(f'Unknown decode mode \'{decode}\'. Expected one of {_decode_modes}.')
+    ids = {_get_msg_id(m) for m in msg_ids} if msg_ids is not None else None
+
+    def accept(frame : bytes) -> Any:
+        mgid, frame_src, frame_src_ent = _get_id_src_src_ent(frame)
+        if (ids is not None and mgid not in ids) or (src is not None and frame_src != src) or (src_ent is not None and frame_src_ent != src_ent):
+            return None
+        if decode == 'eager':
+            return unpack(frame, fast_mode=True)
+        if decode == 'lazy':
+            return _lazy_message(frame, header_view(frame))
+        return frame
+    return accept
+
+def read_lsf(path : str, msg_ids : Optional[list] = None, *, src : Optional[int] = None, src_ent : Optional[int] = None, 
+             decode : str = 'eager', validate : bool = True, chunk_size : int = 1 << 20):
+    '''Synchronously iterates over the messages of a log file, yielding (header, message) tuples.
+
+    Frames are found, validated (CRC), filtered by their header and decoded in a single loop, without an
+    event loop, a child process or a message bus. msg_ids, src and src_ent filter the frames before they
+    are decoded. decode is one of 'eager' (yield messages), 'lazy' (yield _lazy_message) or 'raw' (yield
+    the frames as bytes). validate = False skips the CRC check, which is the most expensive step, and
+    should only be used with trusted files. Bytes that do not belong to a valid frame and a truncated
+    last frame are skipped.
+    '''
+    if decode not in _decode_modes:
+        raise ValueError(f'Unknown decode mode \'{decode}\'. Expected one of {_decode_modes}.')
+    ids = {_get_msg_id(m) for m in msg_ids} if msg_ids is not None else None
+    
+    sync_little, sync_big = _sync_little, _sync_big
+    header_little, header_big = _header_little, _header_big
+    header_data = _pg._base.header_data
+    crc = _core.CRC16IMB
+
+    with open(path, 'rb') as f:
+        buffer = b''
+        pos = 0
+        eof = False
+        while True:
+            # magic number: 22 = 20(header size) + 2(CRC) sizes in bytes.
+            if len(buffer) - pos < 22:
+                if eof:
+                    break
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+
+            sync = buffer[pos:pos + 2]
+            if sync == sync_little:
+                byteorder = 'little'
+                fields = header_little(buffer, pos)
+            elif sync == sync_big:
+                byteorder = 'big'
+                fields = header_big(buffer, pos)
+            else:
+                # look for the next sync number (keep the last byte: it may be half of one)
+                candidates = [i for i in (buffer.find(sync_little, pos + 1), buffer.find(sync_big, pos + 1)) if i != -1]
+                pos = min(candidates) if candidates else len(buffer) - 1
+                continue
+            
+            end = pos + fields[2] + 22
+            if end > len(buffer):
+                if eof:
+                    # a truncated last frame or a false sync number whose size runs past the end of the file: 
+                    # the frames after it must still be found.
+                    pos += 1
+                    continue
+                chunk = f.read(max(chunk_size, end - pos))
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            
+            frame = buffer[pos:end]
+            if validate and crc(frame[:-2]) != int.from_bytes(frame[-2:], byteorder=byteorder):
+                # sync number is not followed by a valid message. Look for the next one.
+                pos += 1
+                continue
+            pos = end
+
+            if (ids is not None and fields[1] not in ids) or (src is not None and fields[4] != src) or (src_ent is not None and fields[5] != src_ent):
+                continue
+            if decode == 'eager':
+                yield (header_data(*fields), unpack(frame, fast_mode=True))
+            elif decode == 'lazy':
+                header = header_data(*fields)
+                yield (header, _lazy_message(frame, header))
+            else:
+                yield (header_data(*fields), frame)
+
+async def _write_batch(io_interface : _core.base_IO_interface, batch : list, counters : Any) -> None:
+    '''Writes the frames of batch with a single call to the IO interface.'''
+    if len(batch) == 1:
+        await io_interface.write(batch[0])
+        counters[_BYTES_WRITTEN] += len(batch[0])
+    else:
+        await io_interface.write_many(batch)
+        counters[_BYTES_WRITTEN] += sum([len(frame) for frame in batch])
+    counters[_FRAMES_WRITTEN] += len(batch)
 
 class _message_bus():
-    '''Injected dependency to 'simplify' common functionalities'''
-    __slots__ = ['_io_interface', '_timeout', '_big_endian', '_block_outgoing']
+    '''Injected dependency to 'simplify' common functionalities
+    
+    Outgoing messages that are pending when the writer runs are gathered in a single write (at most 
+    max_batch of them). If max_delay is given, the writer waits up to max_delay seconds for more messages 
+    before writing a batch that is not full. By default, it does not wait: a single pending message is 
+    written right away.
 
-    def __init__(self, IO_interface : _core.base_IO_interface, timeout = 60, big_endian=False):
+    Outgoing messages can be rate limited per message id and/or per destination (see set_rate_limit).
+
+    If profile (or the PYIMCLSTS_PROFILE environment variable) is a directory, the child process of message_bus
+    is profiled and its profile is written there when it ends (see _profiler).
+
+    At most queue_size received messages wait to be read. When there are more, the oldest are discarded
+    or the reader waits, according to overflow and overflow_policies (see _receive_queue).
+    
+    Pending messages are sent in order of priority (see PRIORITY_HIGH, PRIORITY_NORMAL and PRIORITY_LOW).
+    The priority is given to send() or taken from a {message id : priority} dictionary, which by default
+    gives PRIORITY_HIGH to safety related messages (e.g. Abort) and PRIORITY_NORMAL to the rest. It can be
+    completed with priorities (whose keys can also be message classes or names) or set_priority().'''
+    __slots__ = ['_io_interface', '_timeout', '_big_endian', '_block_outgoing', '_max_batch', '_max_delay', '_priorities', '_rate_limits', 
+                 '_queue_size', '_overflow', '_overflow_policies', '_counters', '_stamp_arrivals', '_profile', '_recorder']
+
+    def __init__(self, IO_interface : _core.base_IO_interface, timeout = 60, big_endian=False, *, 
+                    max_batch : int = 64, max_delay : float = 0, priorities : Optional[dict] = None, 
+                    queue_size : Optional[int] = 1024, overflow : str = 'block', overflow_policies : Optional[dict] = None,
+                    profile : Optional[str] = None):
         self._io_interface = IO_interface
         self._timeout = timeout
 
         # mode to send messages
         self._big_endian = big_endian
         self._block_outgoing = False
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        
+        self._priorities = dict(_default_priorities)
+        if priorities is not None:
+            for msg_id, priority in priorities.items():
+                self.set_priority(msg_id, priority)
+        # a dictionary of {(msg id or None, dst or None) : _token_bucket}
+        self._rate_limits = dict()
+
+        self._queue_size = queue_size
+        self._overflow = overflow
+        self._overflow_policies = overflow_policies
+        # Fail early on invalid policies
+        _receive_queue(queue_size, overflow, overflow_policies)
+
+        self._profile = profile if profile is not None else _os.environ.get(_profile_env_var, None)
+        # Whether the time of arrival of the received frames is kept (see _receive_queue)
+        self._stamp_arrivals = False
+        # See _bus_metrics. Not synchronized: each counter is written by a single process.
+        self._counters = _multiprocessing.Array('Q', len(_bus_metrics), lock=False)
+        # lsf_recorder of the received frames, if any
+        self._recorder = None
     
     def __enter__(self):
         raise NotImplemented
@@ -161,16 +590,106 @@ class _message_bus():
         '''Unblock outgoing messages'''
         self._block_outgoing = False
 
+    def record(self, recorder : Optional[_core.lsf_recorder]) -> None:
+        '''Appends every valid received frame to recorder (see lsf_recorder), as soon as it is read. Must be called 
+        before open(). The recorder runs in the process that reads the IO interface. None stops recording.'''
+        self._recorder = recorder
+
+    def set_priority(self, msg_id : Union[int, _core.IMC_message, str], priority : int) -> None:
+        '''Sets the default priority of a message (given by its id, class or name).'''
+        self._priorities[_get_msg_id(msg_id)] = _clamp_priority(priority)
+
+    def set_rate_limit(self, rate : Optional[float], *, msg_id : Optional[Union[int, _core.IMC_message, str]] = None, 
+                        dst : Optional[int] = None, burst : Optional[float] = None, policy : str = 'drop', 
+                        max_pending : int = 100) -> None:
+        '''Limits the outgoing messages of the given id (class or name) to the given dst to rate messages per second
+        (see _token_bucket). If msg_id or dst are not given, the limit applies to all of them. dst is compared to 
+        the dst given to send(). Each message is subject to only the most specific matching limit: 
+        (msg_id, dst), then (msg_id, any dst), then (any msg_id, dst), then (any, any).
+
+        A rate of None removes the limit.'''
+        key = (_get_msg_id(msg_id) if msg_id is not None else None, dst)
+        if rate is None:
+            self._rate_limits.pop(key, None)
+        else:
+            self._rate_limits[key] = _token_bucket(rate, burst, policy, max_pending)
+
+    def rate_limit_counters(self) -> dict:
+        '''Returns the counters of the rate limits: {(msg id, dst) : {'sent' : 0, 'delayed' : 0, ...}}'''
+        return {key : dict(bucket.counters) for key, bucket in self._rate_limits.items()}
+
+    def metrics(self) -> dict:
+        '''Returns a snapshot of the counters of the bus (see _bus_metrics), the number of messages waiting in the
+        reader queue, of dropped and conflated received messages, the counters of the rate limits and of the recorder.'''
+        snapshot = dict(zip(_bus_metrics, self._counters))
+        reader_queue = getattr(self, '_reader_queue', None)
+        if reader_queue is not None:
+            snapshot['reader_queue'] = reader_queue.qsize()
+            snapshot['frames_dropped'] = reader_queue.counters['dropped']
+            snapshot['frames_conflated'] = reader_queue.counters['conflated']
+        snapshot['rate_limits'] = self.rate_limit_counters()
+        if self._recorder is not None:
+            snapshot['recorder'] = self._recorder.counters()
+        return snapshot
+
+    def _get_bucket(self, msg_id : int, dst : Optional[int]) -> Optional[_token_bucket]:
+        limits = self._rate_limits
+        bucket = limits.get((msg_id, dst), None)
+        if bucket is None:
+            bucket = limits.get((msg_id, None), None)
+            if bucket is None:
+                bucket = limits.get((None, dst), None)
+                if bucket is None:
+                    bucket = limits.get((None, None), None)
+        return bucket
+
     def send(self, message : _pg._base.base_message, *, src : Optional[int] = None, src_ent : Optional[int] = None, 
-                        dst : Optional[int] = None, dst_ent : Optional[int] = None) -> None:
+                        dst : Optional[int] = None, dst_ent : Optional[int] = None, priority : Optional[int] = None) -> None:
         '''Wrapper around a queue (actually a pipe end).'''
         if not self._block_outgoing:
-            self._send(message, src = src, src_ent = src_ent, dst = dst, dst_ent = dst_ent)
+            mgid = message.Attributes.id
+            if priority is None:
+                priority = self._priorities.get(mgid, PRIORITY_NORMAL)
+            else:
+                priority = _clamp_priority(priority)
+            
+            if self._rate_limits:
+                bucket = self._get_bucket(mgid, dst)
+                if bucket is not None:
+                    # Serialized now: the message may be modified (or refilled, if borrowed) before it is released
+                    frame = message.pack(is_big_endian=self._big_endian, src = src, src_ent = src_ent, dst = dst, dst_ent = dst_ent)
+                    bucket.submit((mgid, dst, dst_ent), self._send_raw, (frame, priority), {})
+                    return
+            self._send(message, src = src, src_ent = src_ent, dst = dst, dst_ent = dst_ent, priority = priority)
             
     def _send(self, message : _pg._base.base_message, *, src : Optional[int] = None, src_ent : Optional[int] = None, 
-                        dst : Optional[int] = None, dst_ent : Optional[int] = None) -> None:
+                        dst : Optional[int] = None, dst_ent : Optional[int] = None, priority : int = PRIORITY_NORMAL) -> None:
         raise NotImplemented
 
+    def send_raw(self, frame : bytes, *, priority : Optional[int] = None) -> None:
+        '''Sends an already serialized message (e.g. a received frame) byte-for-byte: it is neither decoded nor 
+        re-encoded, so its header (src, dst, timestamp...), endianness and CRC are kept. Like send(), it is
+        subject to the rate limits and is discarded while outgoing messages are blocked.'''
+        if not self._block_outgoing:
+            self._forward_raw(frame, _clamp_priority(priority) if priority is not None else None)
+
+    def _send_raw(self, frame : bytes, priority : Optional[int] = None) -> None:
+        '''Sends an already serialized message. If no priority is given, it is taken from its message id.'''
+        raise NotImplementedError
+
+    def _frame_priority(self, frame : bytes) -> int:
+        return self._priorities.get(_get_id_src_src_ent(frame)[0], PRIORITY_NORMAL)
+
+    def _forward_raw(self, frame : bytes, priority : Optional[int] = None) -> None:
+        '''As _send_raw, but subject to the rate limits.'''
+        if self._rate_limits:
+            mgid, dst = _get_id_dst(frame)
+            bucket = self._get_bucket(mgid, dst)
+            if bucket is not None:
+                bucket.submit((mgid, dst, frame[19]), self._send_raw, (frame, priority), {})
+                return
+        self._send_raw(frame, priority)
+
 class message_bus(_message_bus):
     '''
         Send and receives messages as bytes, but exposes them as IMC messages
@@ -181,23 +700,34 @@ class message_bus(_message_bus):
         Starts another process that continuously reads/writes to the base_IO_interface.
     '''
 
-    __slots__ = ['_child_end', '_parent_end', '_child_process', '_keep_running', '_big_endian']
+    __slots__ = ['_child_end', '_parent_end', '_child_process', '_keep_running', '_big_endian', '_reader_queue']
+
+    # Frames moved from the pipe to an unbounded queue (queue_size = None) per call to recv
+    _max_transfer = 1024
 
     def _external_listener_loop(self, child_end, timeout : int, keep_running : _multiprocessing.Value) -> None:
         '''All code bellow is executed in a separate process.'''
 
         async def consume_output(io_interface : _core.base_IO_interface) -> None:
             '''Continuously read the pipe end to send messages'''
+            max_batch = self._max_batch
+            queue = _priority_queue()
+
+            def read_pipe() -> None:
+                # Frames are prefixed by their priority
+                while child_end.poll():
+                    data = child_end.recv_bytes()
+                    queue.put_nowait(data[1:], data[0])
             
             while keep_running.value:
-                try:
-                    has_message = child_end.poll()
-                    while has_message:
-                        message = child_end.recv_bytes()
-                        await io_interface.write(message)
-                        has_message = child_end.poll()
-                finally:
-                    pass
+                read_pipe()
+                if self._max_delay and 0 < queue.qsize() < max_batch:
+                    await _asyncio.sleep(self._max_delay)
+                    read_pipe()
+                
+                if not queue.empty():
+                    await _write_batch(io_interface, [queue.get_nowait() for _ in range(min(max_batch, queue.qsize()))], self._counters)
+                self._counters[_WRITER_QUEUE] = queue.qsize()
                 # Yield an exit point to the event loop
                 await _asyncio.sleep(0)
             
@@ -205,46 +735,65 @@ class message_bus(_message_bus):
 
         async def consume_input(io_interface : _core.base_IO_interface):
             '''Continuously read the socket to deserialize messages'''
+            counters = self._counters
+            recorder = self._recorder
 
             buffer = bytearray()
             while keep_running.value:
                 try:
                     # magic number: 6 = sync number + (msgid + msgsize) size in bytes
                     if len(buffer) < 6:
-                        buffer += await io_interface.read(6 - len(buffer))
+                        data = await io_interface.read(6 - len(buffer))
+                        counters[_BYTES_READ] += len(data)
+                        buffer += data
 
                     if int.from_bytes(buffer[:2], byteorder='little') == _pg._base._sync_number:
                         # get msg size
                         size = int.from_bytes(buffer[4:6], byteorder='little')
                         # magic number: 22 = 20(header size) + 2(CRC) sizes in bytes.
                         read_size = max(size + 22 - len(buffer), 0)
-                        buffer += await io_interface.read(read_size)
+                        data = await io_interface.read(read_size)
+                        counters[_BYTES_READ] += len(data)
+                        buffer += data
 
                         # Validate message, but do not unpack yet
                         unparsed_msg = bytes(buffer[:(size + 22)])
                         if _core.CRC16IMB(unparsed_msg[:-2]) == int.from_bytes(unparsed_msg[-2:], byteorder='little'):
+                            if recorder is not None:
+                                recorder.append(unparsed_msg)
                             child_end.send_bytes(unparsed_msg)
                             # eliminate message from buffer
+                            counters[_FRAMES_READ] += 1
                             del buffer[:size + 22]
                         else:
                             # deserialization failed:
                             # sync number is not followed by a sound/valid message. Remove it from buffer
                             # to look for next message
+                            counters[_CRC_FAILURES] += 1
+                            counters[_BYTES_SKIPPED] += 2
                             del buffer[:2]
                     elif int.from_bytes(buffer[:2], byteorder='big') == _pg._base._sync_number:
                         size = int.from_bytes(buffer[4:6], byteorder='big')
                         read_size = max(size + 22 - len(buffer), 0)
-                        buffer += await io_interface.read(read_size)
+                        data = await io_interface.read(read_size)
+                        counters[_BYTES_READ] += len(data)
+                        buffer += data
 
                         unparsed_msg = bytes(buffer[:(size + 22)])
                         if _core.CRC16IMB(unparsed_msg[:-2]) == int.from_bytes(unparsed_msg[-2:], byteorder='big'):
+                            if recorder is not None:
+                                recorder.append(unparsed_msg)
                             child_end.send_bytes(unparsed_msg)
+                            counters[_FRAMES_READ] += 1
                             del buffer[:size + 22]
                         else:
+                            counters[_CRC_FAILURES] += 1
+                            counters[_BYTES_SKIPPED] += 2
                             del buffer[:2]
                     else:
                         # buffer does not start with a sync number. Remove it to search
                         # for a valid sync number.
+                        counters[_BYTES_SKIPPED] += 2
                         del buffer[:2]
                 except EOFError as e:
                     print("EOF reached by the stream reader. Waiting for stream writer to finish...")
@@ -267,9 +816,13 @@ class message_bus(_message_bus):
             print("Reader stream has been closed.")
         async def main_loop():
             await self._io_interface.open()
+            if self._recorder is not None:
+                self._recorder.start()
             try:
                 await _asyncio.gather(consume_input(self._io_interface), consume_output(self._io_interface))
             finally:
+                if self._recorder is not None:
+                    self._recorder.stop()
                 child_end.close()
                 print('IO interface has been closed.')
                 await self._io_interface.close()
@@ -289,10 +842,14 @@ class message_bus(_message_bus):
         self._parent_end, self._child_end = _multiprocessing.Pipe(duplex=True)
 
         self._keep_running = _multiprocessing.Value('i', True)
+        # Frames are taken from the pipe to this queue, where the overflow policies are applied.
+        # The pipe itself is bounded, so the child process blocks when it is full.
+        self._reader_queue = _receive_queue(self._queue_size, self._overflow, self._overflow_policies, self._stamp_arrivals)
 
         # Start process
-        self._child_process = _multiprocessing.Process(target=self._external_listener_loop, 
-                                                        args=(self._child_end, self._timeout, self._keep_running))
+        self._child_process = _multiprocessing.Process(target=_run_profiled, 
+                                                        args=(self._profile, 'message_bus', self._external_listener_loop, 
+                                                                self._child_end, self._timeout, self._keep_running))
         self._child_process.start()
 
         # It is very likely that the main process will run faster than the child process, which
@@ -309,15 +866,35 @@ class message_bus(_message_bus):
         self._child_process.close()
 
     def _send(self, message : _pg._base.base_message, *, src : Optional[int] = None, src_ent : Optional[int] = None, 
-                        dst : Optional[int] = None, dst_ent : Optional[int] = None) -> None:
-        self._parent_end.send_bytes(message.pack(is_big_endian=self._big_endian, src = src, src_ent = src_ent, 
+                        dst : Optional[int] = None, dst_ent : Optional[int] = None, priority : int = PRIORITY_NORMAL) -> None:
+        self._parent_end.send_bytes(bytes((priority,)) + message.pack(is_big_endian=self._big_endian, src = src, src_ent = src_ent, 
                         dst = dst, dst_ent = dst_ent))
 
+    def _send_raw(self, frame : bytes, priority : Optional[int] = None) -> None:
+        if priority is None:
+            priority = self._frame_priority(frame)
+        self._parent_end.send_bytes(bytes((priority,)) + frame)
+
     def recv(self) -> _pg._base.base_message:
         '''Wrapper around a queue (actually a pipe end). Blocks until a message is available.
         The _external_listener_loop is supposed to send complete messages (as per multiprocessing 
         documentation).'''       
-        msg = self._parent_end.recv_bytes()
+        queue = self._reader_queue
+        # Move the frames in the pipe to the queue, until it is full of frames that must not be discarded.
+        # At most one queue of frames per call, so that a fast sender cannot keep this loop running.
+        for _ in range(self._queue_size if self._queue_size is not None else self._max_transfer):
+            if not self._parent_end.poll():
+                break
+            msg = self._parent_end.recv_bytes()
+            if not queue.offer(msg) or msg == b'':
+                break
+        
+        if queue.empty():
+            msg = self._parent_end.recv_bytes()
+            if self._stamp_arrivals:
+                queue.last_arrival = _time.monotonic()
+        else:
+            msg = queue.get_nowait()
         
         if msg == b'':
             raise EOFError('Message Bus has been closed.')
@@ -328,7 +905,7 @@ class message_bus(_message_bus):
         '''Extra function to check whether there are any available messages.
         Check _multiprocessing module pipes.
         '''
-        return self._parent_end.poll(timeout=timeout)
+        return not self._reader_queue.empty() or self._parent_end.poll(timeout=timeout)
 
     def __enter__(self):
         self.open()
@@ -350,74 +927,178 @@ class message_bus_st(_message_bus):
         asynchronous methods.
 
         DOES NOT start another process. Runs in the main process.
+
+        Can be used as an asynchronous context manager and the received messages can be iterated with
+        messages() and batches(), e.g.:
+
+            async with message_bus_st(tcp_interface('localhost', 6006)) as bus:
+                async for msg in bus.messages([EstimatedState], src=0x1E):
+                    ...
     '''
 
-    __slots__ = ['_writer_queue', '_reader_queue', '_keep_running', '_big_endian', '_task']
+    __slots__ = ['_writer_queue', '_reader_queue', '_keep_running', '_big_endian', '_task', '_writing']
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+        return None
+
+    async def messages(self, msg_ids : Optional[list] = None, *, src : Optional[int] = None, src_ent : Optional[int] = None, 
+                        decode : str = 'eager'):
+        '''Asynchronous iterator over the received messages of the given ids (classes or names; all, if not given) 
+        from the given src and src_ent. It ends at the end of the stream. 
+        
+        decode can be 'eager' (messages are decoded), 'lazy' (messages are decoded when their fields are read; 
+        see _lazy_message) or 'raw' (the frames, as bytes).'''
+        accept = _frame_filter(msg_ids, src, src_ent, decode)
+        while True:
+            try:
+                frame = await self.recv()
+            except EOFError:
+                return
+            item = accept(frame)
+            if item is not None:
+                yield item
+
+    async def batches(self, max_n : int, max_delay : float, msg_ids : Optional[list] = None, *, src : Optional[int] = None, 
+                        src_ent : Optional[int] = None, decode : str = 'eager'):
+        '''As messages(), but yields lists of at most max_n messages. A batch is yielded as soon as it is full
+        or max_delay seconds after its first message has been received.'''
+        accept = _frame_filter(msg_ids, src, src_ent, decode)
+        queue = self._reader_queue
+        loop = _asyncio.get_running_loop()
+        end_of_stream = False
+        while not end_of_stream:
+            batch = []
+            deadline = None
+            while len(batch) < max_n:
+                if queue.empty():
+                    if deadline is None:
+                        await queue.wait()
+                    else:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        try:
+                            # Waiting (instead of getting) so that no frame is lost if it times out
+                            await _asyncio.wait_for(queue.wait(), remaining)
+                        except _asyncio.TimeoutError:
+                            break
+                frame = queue.get_nowait()
+                
+                if frame == b'':
+                    end_of_stream = True
+                    break
+                item = accept(frame)
+                if item is not None:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = loop.time() + max_delay
+            if batch:
+                yield batch
     
     async def open(self):
         self._keep_running = True
 
-        self._writer_queue = _asyncio.Queue()
-        self._reader_queue = _asyncio.Queue()
+        self._writer_queue = _priority_queue()
+        self._reader_queue = _receive_queue(self._queue_size, self._overflow, self._overflow_policies, self._stamp_arrivals)
+        self._writing = False
 
         async def consume_output(io_interface : _core.base_IO_interface):
-            '''Continuously read the pipe end to send messages'''
+            '''Continuously read the queue to send messages'''
+            queue = self._writer_queue
+            max_batch = self._max_batch
             
             while self._keep_running:
+                if queue.empty():
+                    # wait, but check _keep_running from time to time
+                    try:
+                        batch = [await _asyncio.wait_for(queue.get(), 0.5)]
+                    except _asyncio.TimeoutError:
+                        continue
+                else:
+                    batch = [queue.get_nowait()]
+                
+                while len(batch) < max_batch and not queue.empty():
+                    batch.append(queue.get_nowait())
+                
+                if self._max_delay and len(batch) < max_batch:
+                    await _asyncio.sleep(self._max_delay)
+                    while len(batch) < max_batch and not queue.empty():
+                        batch.append(queue.get_nowait())
+                
+                self._writing = True
                 try:
-                    # flush queue or wait.
-                    while not self._writer_queue.empty():
-                        message = await self._writer_queue.get()
-                        await io_interface.write(message)
-                    else:
-                        await _asyncio.sleep(0.5)
+                    await _write_batch(io_interface, batch, self._counters)
                 finally:
-                    pass
+                    self._writing = False
             
             print("Writer stream has been closed.")
 
         async def consume_input(io_interface : _core.base_IO_interface):
             '''Continuously read the socket to deserialize messages'''
+            counters = self._counters
+            recorder = self._recorder
             
             buffer = bytearray()
             while self._keep_running:
                 try:
                     # magic number: 6 = sync number + (msgid + msgsize) size in bytes
                     if len(buffer) < 6:
-                        buffer += await io_interface.read(6 - len(buffer))
+                        data = await io_interface.read(6 - len(buffer))
+                        counters[_BYTES_READ] += len(data)
+                        buffer += data
 
                     if int.from_bytes(buffer[:2], byteorder='little') == _pg._base._sync_number:
                         # get msg size
                         size = int.from_bytes(buffer[4:6], byteorder='little')
                         # magic number: 22 = 20(header size) + 2(CRC) sizes in bytes.
                         read_size = max(size + 22 - len(buffer), 0)
-                        buffer += await io_interface.read(read_size)
+                        data = await io_interface.read(read_size)
+                        counters[_BYTES_READ] += len(data)
+                        buffer += data
 
                         # Validate message, but do not unpack yet
                         unparsed_msg = bytes(buffer[:(size + 22)])
                         if _core.CRC16IMB(unparsed_msg[:-2]) == int.from_bytes(unparsed_msg[-2:], byteorder='little'):
+                            if recorder is not None:
+                                recorder.append(unparsed_msg)
                             await self._reader_queue.put(unparsed_msg)
                             # eliminate message from buffer
+                            counters[_FRAMES_READ] += 1
                             del buffer[:size + 22]
                         else:
                             # deserialization failed:
                             # sync number is not followed by a sound/valid message. Remove it from buffer
                             # to look for next message
+                            counters[_CRC_FAILURES] += 1
+                            counters[_BYTES_SKIPPED] += 2
                             del buffer[:2]
                     elif int.from_bytes(buffer[:2], byteorder='big') == _pg._base._sync_number:
                         size = int.from_bytes(buffer[4:6], byteorder='big')
                         read_size = max(size + 22 - len(buffer), 0)
-                        buffer += await io_interface.read(read_size)
+                        data = await io_interface.read(read_size)
+                        counters[_BYTES_READ] += len(data)
+                        buffer += data
 
                         unparsed_msg = bytes(buffer[:(size + 22)])
                         if _core.CRC16IMB(unparsed_msg[:-2]) == int.from_bytes(unparsed_msg[-2:], byteorder='big'):
+                            if recorder is not None:
+                                recorder.append(unparsed_msg)
                             await self._reader_queue.put(unparsed_msg)
+                            counters[_FRAMES_READ] += 1
                             del buffer[:size + 22]
                         else:
+                            counters[_CRC_FAILURES] += 1
+                            counters[_BYTES_SKIPPED] += 2
                             del buffer[:2]
                     else:
                         # buffer does not start with a sync number. Remove it to search
                         # for a valid sync number.
+                        counters[_BYTES_SKIPPED] += 2
                         del buffer[:2]
                 except EOFError as e:
                     print("EOF reached by the stream reader. Waiting for stream writer to finish...")
@@ -437,23 +1118,42 @@ class message_bus_st(_message_bus):
             print("Reader stream has been closed.")
         async def main_loop():
             await self._io_interface.open()
+            if self._recorder is not None:
+                self._recorder.start()
             try:
                 await _asyncio.gather(consume_input(self._io_interface), consume_output(self._io_interface))
             finally:
+                if self._recorder is not None:
+                    self._recorder.stop()
                 print('IO interface has been closed.')
                 await self._io_interface.close()
 
         self._task = _asyncio.create_task(main_loop())
     
+    async def flush(self, timeout : float = 1) -> bool:
+        '''Waits (at most timeout seconds) until the queued outgoing messages have been written. Returns whether 
+        they have.'''
+        deadline = _time.monotonic() + timeout
+        while not self._writer_queue.empty() or self._writing:
+            if _time.monotonic() > deadline or self._task.done():
+                return False
+            await _asyncio.sleep(0.01)
+        return True
+
     def close(self, max_wait : float = 1) -> None:
         self._keep_running = False
         self._task.cancel()
         print('Message Bus has been closed.')
 
     def _send(self, message : _pg._base.base_message, *, src : Optional[int] = None, src_ent : Optional[int] = None, 
-                        dst : Optional[int] = None, dst_ent : Optional[int] = None) -> None:
+                        dst : Optional[int] = None, dst_ent : Optional[int] = None, priority : int = PRIORITY_NORMAL) -> None:
         self._writer_queue.put_nowait(message.pack(is_big_endian=self._big_endian, src = src, src_ent = src_ent, 
-                        dst = dst, dst_ent = dst_ent))
+                        dst = dst, dst_ent = dst_ent), priority)
+
+    def _send_raw(self, frame : bytes, priority : Optional[int] = None) -> None:
+        if priority is None:
+            priority = self._frame_priority(frame)
+        self._writer_queue.put_nowait(frame, priority)
 
     async def recv(self) -> _pg._base.base_message:
         '''Wrapper around a queue (actually a pipe end). Blocks until a message is available.
@@ -471,6 +1171,13 @@ class message_bus_st(_message_bus):
         '''Extra function to check whether there are any available messages.
         '''
         return not self._reader_queue.empty()
+
+    def metrics(self) -> dict:
+        snapshot = super().metrics()
+        writer_queue = getattr(self, '_writer_queue', None)
+        if writer_queue is not None:
+            snapshot['writer_queue'] = writer_queue.qsize()
+        return snapshot
     
     def __exit__(self, exc_type, exc_value, exc_tb):
         self.close()
@@ -480,18 +1187,615 @@ class message_bus_st(_message_bus):
         print('Message bus event loop has been closed.')
         return None
 
+class _concurrent_callback:
+    '''Wraps a subscribed coroutine so that each call is scheduled as a task, instead of being awaited by the
+    main loop of the subscriber. At most max_concurrency calls are in flight: when the limit is reached, the main 
+    loop waits until one of them finishes. If ordered, the calls for messages of the same (message id, src) wait
+    for the previous one to finish.'''
+
+    __slots__ = ['_callback', '_max_concurrency', '_ordered', '_semaphore', '_tasks', '_last_task']
+
+    def __init__(self, callback : Callable, max_concurrency : int, ordered : bool = False) -> None:
+        self._callback = callback
+        self._max_concurrency = max_concurrency
+        self._ordered = ordered
+        # Created in the running event loop
+        self._semaphore = None
+        self._tasks = set()
+        # a dictionary of {(mgid, src) : last scheduled task}
+        self._last_task = dict()
+
+    def __repr__(self) -> str:
+        return f'_concurrent_callback({self._callback!r}, max_concurrency={self._max_concurrency}, ordered={self._ordered})'
+
+    async def __call__(self, msg : _core.IMC_message, send_callback : Callable) -> None:
+        if self._semaphore is None:
+            self._semaphore = _asyncio.Semaphore(self._max_concurrency)
+        await self._semaphore.acquire()
+
+        key = (msg.Attributes.id, msg._header.src if getattr(msg, '_header', None) is not None else None)
+        previous = self._last_task.get(key, None) if self._ordered else None
+        
+        task = _asyncio.ensure_future(self._run(msg, send_callback, previous))
+        self._tasks.add(task)
+        # Released when the task is done, even if it is cancelled before it starts
+        task.add_done_callback(_functools.partial(self._done, key, self._semaphore))
+        if self._ordered:
+            self._last_task[key] = task
+
+    async def _run(self, msg : _core.IMC_message, send_callback : Callable, previous : Optional[_asyncio.Future]) -> None:
+        if previous is not None:
+            # wait, but do not propagate its exception
+            await _asyncio.wait([previous])
+        await self._callback(msg, send_callback)
+
+    def _done(self, key : Tuple[int, int], semaphore : _asyncio.Semaphore, task : _asyncio.Future) -> None:
+        semaphore.release()
+        self._tasks.discard(task)
+        if self._last_task.get(key, None) is task:
+            del self._last_task[key]
+        if not task.cancelled() and task.exception() is not None:
+            print(f'Warning: Callback {self._callback} raised {task.exception()!r}')
+
+    async def join(self) -> None:
+        '''Waits for the scheduled calls to finish.'''
+        while self._tasks:
+            await _asyncio.wait(list(self._tasks))
+        # bound to the event loop that is about to be closed
+        self._semaphore = None
+
+def _threadsafe_send(loop : _asyncio.AbstractEventLoop, send_callback : Callable, message : _core.IMC_message, **kwargs) -> None:
+    '''Send callback given to functions that run in other threads. Schedules the send in the event loop.'''
+    loop.call_soon_threadsafe(_functools.partial(send_callback, message, **kwargs))
+
+def _mp_worker(connection : Any, callbacks : list, big_endian : bool, priorities : dict) -> None:
+    '''Main function of the worker processes of subscribe_mp. Executed in a separate process.
+    
+    Receives (callback indices, frame) tuples, decodes the frame and calls the callbacks. Messages sent by
+    the callbacks are serialized here and sent back as bytes, prefixed by their priority. An empty byte 
+    string signals that a frame has been processed.'''
+    loop = None
+
+    def send(message : _core.IMC_message, *, src : Optional[int] = None, src_ent : Optional[int] = None, 
+                        dst : Optional[int] = None, dst_ent : Optional[int] = None, priority : Optional[int] = None) -> None:
+        if priority is None:
+            priority = priorities.get(message.Attributes.id, PRIORITY_NORMAL)
+        else:
+            priority = _clamp_priority(priority)
+        connection.send_bytes(bytes((priority,)) + message.pack(is_big_endian=big_endian, src = src, src_ent = src_ent, dst = dst, dst_ent = dst_ent))
+
+    try:
+        while True:
+            try:
+                item = connection.recv()
+            except EOFError:
+                break
+            if item is None:
+                break
+
+            indices, frame = item
+            try:
+                msg = _pg._base._freeze(unpack(frame, fast_mode=True))
+            except Exception as e:
+                print(f'Warning: Could not decode a frame of message {_get_id_src_src_ent(frame)[0]}: {e!r}')
+                indices = ()
+            for i in indices:
+                try:
+                    if _inspect.iscoroutinefunction(callbacks[i]):
+                        if loop is None:
+                            loop = _asyncio.new_event_loop()
+                        loop.run_until_complete(callbacks[i](msg, send))
+                    else:
+                        callbacks[i](msg, send)
+                except Exception as e:
+                    print(f'Warning: Callback {callbacks[i]} raised {e!r}')
+            connection.send_bytes(b'')
+    finally:
+        if loop is not None:
+            loop.close()
+        connection.close()
+
+class _mp_subscription:
+    '''Entry of a subscribe_mp callback in the subscriptions table. The call is executed by the process pool.'''
+    __slots__ = ['index']
+
+    def __init__(self, index : int) -> None:
+        self.index = index
+
+class _process_pool:
+    '''Persistent worker processes that execute the callbacks subscribed with subscribe_mp.
+    
+    Workers receive the raw frames (not pickled messages) and decode them. If shard_by_src, the frames of a
+    given src are always sent to the same worker, so that per-vehicle state can be kept in one process. 
+    Otherwise, frames are distributed in turns. At most max_pending frames can be waiting in each worker;
+    when the limit is reached, the main loop waits for the worker to catch up (backpressure).
+    
+    Messages sent by the callbacks are received already serialized and forwarded with send_raw.
+
+    A worker that exits (e.g. a callback called os._exit) is replaced by a new one. The frames that were 
+    waiting in it are lost and counted as dropped.
+
+    If profile is a directory, the workers are profiled (see _profiler).
+    '''
+    __slots__ = ['_callbacks', '_n_workers', '_shard_by_src', '_max_pending', '_big_endian', '_profile',
+                 '_connections', '_processes', '_pending', '_available', '_next', '_send_raw', '_priorities', 'dropped']
+
+    def __init__(self, callbacks : list, n_workers : Optional[int] = None, shard_by_src : bool = True, 
+                    max_pending : int = 64, big_endian : bool = False, profile : Optional[str] = None) -> None:
+        self._callbacks = callbacks
+        self._n_workers = n_workers if n_workers is not None else (_os.cpu_count() or 1)
+        self._shard_by_src = shard_by_src
+        self._max_pending = max_pending
+        self._big_endian = big_endian
+        self._profile = profile
+        # number of frames lost by workers that exited
+        self.dropped = 0
+
+    def start(self, send_raw : Callable[[bytes, int], None], priorities : dict) -> None:
+        '''Starts the workers. Must be called in the running event loop. priorities are the default priorities of
+        the messages sent by the callbacks.'''
+        self._send_raw = send_raw
+        self._priorities = priorities
+        self._connections = [None] * self._n_workers
+        self._processes = [None] * self._n_workers
+        self._pending = [0] * self._n_workers
+        self._available = [_asyncio.Event() for _ in range(self._n_workers)]
+        self._next = 0
+
+        for i in range(self._n_workers):
+            self._spawn(i)
+
+    def _spawn(self, worker : int) -> None:
+        parent_end, child_end = _multiprocessing.Pipe(duplex=True)
+        process = _multiprocessing.Process(target=_run_profiled, args=(self._profile, 'mp_worker', _mp_worker, 
+                                            child_end, self._callbacks, self._big_endian, self._priorities), daemon=True)
+        process.start()
+        child_end.close()
+        
+        self._connections[worker] = parent_end
+        self._processes[worker] = process
+        self._pending[worker] = 0
+        _asyncio.get_running_loop().add_reader(parent_end.fileno(), self._read, worker)
+
+    def _respawn(self, worker : int) -> None:
+        '''Replaces a worker that has exited.'''
+        print(f'Warning: subscribe_mp worker {worker} has exited (exit code {self._processes[worker].exitcode}). Starting a new one.')
+        connection = self._connections[worker]
+        if not connection.closed:
+            _asyncio.get_running_loop().remove_reader(connection.fileno())
+            connection.close()
+        self._processes[worker].join()
+        self._processes[worker].close()
+        self.dropped += self._pending[worker]
+        self._spawn(worker)
+        self._available[worker].set()
+
+    async def submit(self, frame : bytes, src : int, indices : Tuple[int, ...]) -> None:
+        '''Sends the frame to a worker, to be given to the callbacks of the given indices.'''
+        if self._shard_by_src:
+            worker = src % self._n_workers
+        else:
+            worker = self._next
+            self._next = (self._next + 1) % self._n_workers
+        
+        while self._pending[worker] >= self._max_pending and not self._connections[worker].closed:
+            self._available[worker].clear()
+            await self._available[worker].wait()
+        
+        if self._connections[worker].closed:
+            self._respawn(worker)
+        try:
+            self._connections[worker].send((indices, frame))
+            self._pending[worker] += 1
+        except OSError:
+            # The worker exited in the meantime (BrokenPipeError is an OSError)
+            self.dropped += 1
+            self._respawn(worker)
+
+    def _read(self, worker : int) -> None:
+        connection = self._connections[worker]
+        try:
+            while connection.poll():
+                data = connection.recv_bytes()
+                if data:
+                    self._send_raw(data[1:], data[0])
+                else:
+                    self._pending[worker] -= 1
+                    self._available[worker].set()
+        except (EOFError, OSError):
+            # Worker has exited. It is replaced by the next submit.
+            _asyncio.get_running_loop().remove_reader(connection.fileno())
+            connection.close()
+            self._available[worker].set()
+
+    async def close(self, timeout : float = 5) -> None:
+        '''Waits (at most timeout seconds) for the workers to process the pending frames and stops them. 
+        Workers that are still running after that (e.g. a callback that hangs) are terminated.'''
+        loop = _asyncio.get_running_loop()
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        
+        # Keep forwarding their messages while they finish
+        deadline = _time.monotonic() + timeout
+        while any([p.is_alive() for p in self._processes]) and _time.monotonic() < deadline:
+            await _asyncio.sleep(0.01)
+        for i, process in enumerate(self._processes):
+            if process.is_alive():
+                print(f'Warning: subscribe_mp worker {i} did not finish within {timeout} s. Terminating it.')
+                process.terminate()
+                process.join(1)
+                if process.is_alive():
+                    process.kill()
+        
+        for i, connection in enumerate(self._connections):
+            if connection is not None and not connection.closed:
+                self._read(i)
+                # _read closes it if the worker has already exited
+                if not connection.closed:
+                    loop.remove_reader(connection.fileno())
+                    connection.close()
+        for process in self._processes:
+            if process is not None:
+                process.join()
+                process.close()
+
+class _timer:
+    '''Handle of a function registered with periodic_async or call_once.
+
+    The function is called every period seconds (or once, if period is None), the first call happening
+    delay seconds after the main loop starts (or after the registration, if it is already running).
+    missed counts the calls that have been skipped because their deadline had already passed.'''
+    __slots__ = ['_callback', '_period', '_delay', '_scheduler', '_entry', '_task', 'missed']
+
+    def __init__(self, callback : Callable, period : Optional[float], delay : float = 0) -> None:
+        self._callback = callback
+        self._period = period
+        self._delay = delay
+        # Set when the timer is scheduled
+        self._scheduler = None
+        # Sequence number of its current entry in the heap. Entries with another number are stale.
+        self._entry = None
+        # Last call of a coroutine
+        self._task = None
+        self.missed = 0
+
+    def __repr__(self) -> str:
+        return f'_timer({self._callback!r}, period={self._period}, delay={self._delay})'
+
+    def cancel(self) -> None:
+        '''Stops calling the function. A call that is already running is not interrupted.'''
+        self._entry = None
+        self._delay = None
+
+    def reschedule(self, *, period : Optional[float] = None, delay : Optional[float] = None) -> None:
+        '''Changes the period (if given) and sets the next call to delay seconds from now. If no delay is
+        given, the next call happens one period from now.'''
+        if period is not None:
+            self._period = period
+        if delay is None:
+            delay = self._period if self._period is not None else 0
+        self._delay = delay
+        if self._scheduler is not None and self._scheduler.is_running():
+            self._scheduler.schedule(self)
+
+class _scheduler:
+    '''Drives every _timer of a subscriber with a single timer handle in the event loop.
+
+    Pending calls are kept in a heap ordered by their (absolute) deadline. The next deadline of a periodic
+    timer is computed from the previous deadline, not from the time of the call, so calls do not drift.
+    When deadlines are missed (the event loop was busy or a previous call of a coroutine is still running),
+    the calls are skipped, counted in _timer.missed and reported.
+    '''
+    __slots__ = ['_heap', '_counter', '_loop', '_handle', '_tasks', '_send_callback']
+
+    def __init__(self) -> None:
+        # a heap of (deadline, sequence number, timer)
+        self._heap = []
+        self._counter = 0
+        self._loop = None
+        self._handle = None
+        # running calls of coroutines
+        self._tasks = set()
+
+    def start(self, timers : list, send_callback : Callable) -> None:
+        '''Schedules the given timers. Must be called in the running event loop.'''
+        self._loop = _asyncio.get_running_loop()
+        self._send_callback = send_callback
+        for timer in timers:
+            if timer._delay is not None:
+                self.schedule(timer)
+
+    def stop(self) -> None:
+        '''Removes every pending call and cancels the running coroutines.'''
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        for _, _, timer in self._heap:
+            timer._entry = None
+        for task in self._tasks:
+            task.cancel()
+        self._heap = []
+        self._loop = None
+
+    def is_running(self) -> bool:
+        return self._loop is not None
+
+    def schedule(self, timer : _timer) -> None:
+        '''Schedules the next call of timer to _timer._delay seconds from now.'''
+        self._counter += 1
+        timer._scheduler = self
+        timer._entry = self._counter
+        _heapq.heappush(self._heap, (self._loop.time() + timer._delay, self._counter, timer))
+        # Re-arm only if it is the new earliest deadline
+        if self._heap[0][2] is timer:
+            self._arm()
+
+    def _arm(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        # Discard stale entries (cancelled or rescheduled)
+        heap = self._heap
+        while heap and heap[0][2]._entry != heap[0][1]:
+            _heapq.heappop(heap)
+
+        if heap:
+            self._handle = self._loop.call_at(heap[0][0], self._fire)
+
+    def _fire(self) -> None:
+        self._handle = None
+        now = self._loop.time()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, entry, timer = _heapq.heappop(heap)
+            if timer._entry != entry:
+                continue
+
+            if timer._period is not None:
+                # Computed from the deadline, not from now
+                next_deadline = deadline + timer._period
+                if next_deadline <= now:
+                    missed = int((now - next_deadline) // timer._period) + 1
+                    next_deadline += missed * timer._period
+                    self._report(timer, missed)
+                self._counter += 1
+                timer._entry = self._counter
+                _heapq.heappush(heap, (next_deadline, self._counter, timer))
+            else:
+                timer._entry = None
+
+            self._call(timer)
+        self._arm()
+
+    def _call(self, timer : _timer) -> None:
+        f = timer._callback
+        try:
+            if _inspect.iscoroutinefunction(f):
+                if timer._task is not None and not timer._task.done():
+                    self._report(timer, 1)
+                    return
+                timer._task = _asyncio.ensure_future(f(self._send_callback))
+                timer._task.add_done_callback(_functools.partial(self._done, timer))
+                self._tasks.add(timer._task)
+            else:
+                f(self._send_callback)
+        except Exception as e:
+            print(f'Warning: Scheduled function {f} raised {e!r}')
+
+    def _done(self, timer : _timer, task : _asyncio.Future) -> None:
+        self._tasks.discard(task)
+        if timer._task is task:
+            timer._task = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f'Warning: Scheduled function {timer._callback} raised {task.exception()!r}')
+
+    def _report(self, timer : _timer, missed : int) -> None:
+        timer.missed += missed
+        print(f'Warning: Scheduled function {timer._callback} missed {missed} deadline(s) ({timer.missed} in total).')
+
+class _histogram:
+    '''Histogram of durations with a bucket per power of two of microseconds: bucket i counts the durations
+    in [2^(i-1), 2^i) us. Quantiles are approximated by the upper bound of their bucket.'''
+    __slots__ = ['buckets', 'count', 'total', 'max']
+
+    def __init__(self) -> None:
+        self.buckets = [0] * 32
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds : float) -> None:
+        if seconds < 0:
+            seconds = 0.0
+        self.buckets[min(int(seconds * 1e6).bit_length(), 31)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other : '_histogram') -> None:
+        '''Adds the durations counted by other.'''
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q : float) -> float:
+        '''Upper bound (in seconds) of the bucket that contains the q-quantile.'''
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min((1 << i) * 1e-6, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        if self.count == 0:
+            return {'count' : 0}
+        return {'count' : self.count, 'mean' : self.total / self.count, 'max' : self.max, 
+                'p50' : self.quantile(0.5), 'p90' : self.quantile(0.9), 'p99' : self.quantile(0.99)}
+
+def _callback_name(f : Callable) -> str:
+    '''Name of a subscribed function, looking through the wrappers of the subscriber.'''
+    while True:
+        if isinstance(f, _functools.partial) and f.func is _core._async_wrapper:
+            f = f.args[0]
+        elif isinstance(f, _concurrent_callback):
+            f = f._callback
+        else:
+            return getattr(f, '__qualname__', repr(f))
+
+class _latency_stats:
+    '''Times the calls of the subscribed functions. For each (function, message type), it keeps histograms of 
+    the duration of the calls ('duration'), of the time from the arrival of the frame to the start of the call 
+    ('receive_delay') and from the timestamp of the message header to the start of the call ('header_delay').
+    The statistics of different functions with the same name (e.g. a function subscribed twice or methods of 
+    different instances) for the same message type are reported together.
+    
+    Calls that take longer than slow_threshold seconds are reported.'''
+    __slots__ = ['slow_threshold', 'dump', '_stats', '_names']
+
+    def __init__(self, slow_threshold : Optional[float] = None, dump : Optional[str] = None) -> None:
+        self.slow_threshold = slow_threshold
+        self.dump = dump
+        # a dictionary of {(callback, mgid) : (duration, receive delay, header delay) histograms}
+        self._stats = dict()
+        # a dictionary of {callback : name}
+        self._names = dict()
+
+    async def call(self, callbacks : list, message : _core.IMC_message, send_callback : Callable, arrival : Optional[float]) -> None:
+        mgid = message.Attributes.id
+        timestamp = message._header.timestamp if message._header is not None else None
+        for f in callbacks:
+            stats = self._stats.get((f, mgid), None)
+            if stats is None:
+                stats = self._stats[(f, mgid)] = (_histogram(), _histogram(), _histogram())
+            
+            start = _time.monotonic()
+            if arrival is not None:
+                stats[1].add(start - arrival)
+            if timestamp is not None:
+                stats[2].add(_time.time() - timestamp)
+            
+            await f(message, send_callback)
+            
+            duration = _time.monotonic() - start
+            stats[0].add(duration)
+            if self.slow_threshold is not None and duration > self.slow_threshold:
+                print(f'Warning: Callback {self._name(f)} took {duration * 1000:.1f} ms to process {type(message).__name__}.')
+
+    def _name(self, f : Callable) -> str:
+        name = self._names.get(f, None)
+        if name is None:
+            name = self._names[f] = _callback_name(f)
+        return name
+
+    def _merged(self) -> dict:
+        '''Returns {(callback name, message name) : (duration, receive delay, header delay) histograms}, merging
+        the histograms of the callbacks with the same name.'''
+        merged = dict()
+        for (f, mgid), stats in self._stats.items():
+            message_class = _pg._base._get_message_class(mgid)
+            key = (self._name(f), message_class[0].__name__ if message_class is not None else str(mgid))
+            histograms = merged.get(key, None)
+            if histograms is None:
+                histograms = merged[key] = (_histogram(), _histogram(), _histogram())
+            for h, other in zip(histograms, stats):
+                h.merge(other)
+        return merged
+
+    def snapshot(self) -> dict:
+        '''Returns {(callback name, message name) : {'duration' : {...}, 'receive_delay' : {...}, 'header_delay' : {...}}}.
+        Durations are in seconds.'''
+        return {key : {'duration' : stats[0].summary(), 'receive_delay' : stats[1].summary(), 'header_delay' : stats[2].summary()}
+                for key, stats in self._merged().items()}
+
+    def write(self, file_name : str) -> None:
+        '''Writes the snapshot and the buckets of the histograms to a JSON file.'''
+        output = []
+        for (name, message), stats in self._merged().items():
+            output.append({'callback' : name, 'message' : message, 
+                           'duration' : stats[0].summary(), 'receive_delay' : stats[1].summary(), 'header_delay' : stats[2].summary(),
+                           'buckets_us' : {'duration' : stats[0].buckets, 'receive_delay' : stats[1].buckets, 
+                                           'header_delay' : stats[2].buckets}})
+        with open(file_name, 'w') as f:
+            _json.dump(output, f, indent=1)
+
+def _format_metrics(snapshot : dict, prefix : str = 'pyimclsts') -> str:
+    '''Formats a metrics snapshot as text, one 'name value' or 'name{label="key"} value' per line.'''
+    lines = []
+    for name, value in snapshot.items():
+        if isinstance(value, dict):
+            for key, v in value.items():
+                if isinstance(v, dict):
+                    lines += [f'{prefix}_{name}_{k}{{key="{key}"}} {c}' for k, c in v.items()]
+                else:
+                    lines.append(f'{prefix}_{name}{{key="{key}"}} {v}')
+        else:
+            lines.append(f'{prefix}_{name} {value}')
+    return '\n'.join(lines) + '\n'
+
 class subscriber:
 
-    __slots__ = ['_msg_manager', '_subscriptions', '_subscripted_all', '_periodic', '_call_once', '_use_mp', '_peers', '_src2name', '_keep_running']
+    __slots__ = ['_msg_manager', '_subscriptions', '_subscripted_all', '_routes', '_concurrent', '_executor', '_mp_callbacks', '_mp_pool', '_scheduler', '_periodic', '_call_once', '_cached_ids', '_latest', '_borrowed', '_pool', '_msg_counts', '_metrics_last', '_metrics_address', '_latency', '_use_mp', '_peers', '_src2name', '_peer_ids', '_keep_running']
 
-    def __init__(self, IO_interface : _core.base_IO_interface, *,big_endian=False, use_mp = False) -> None:
+    def __init__(self, IO_interface : _core.base_IO_interface, *,big_endian=False, use_mp = False, 
+                    mp_workers : Optional[int] = None, mp_shard_by_src : bool = True, mp_max_pending : int = 64,
+                    write_batch : int = 64, write_delay : float = 0, priorities : Optional[dict] = None,
+                    queue_size : Optional[int] = 1024, overflow : str = 'block', overflow_policies : Optional[dict] = None,
+                    profile : Optional[str] = None) -> None:
+        '''mp_workers, mp_shard_by_src and mp_max_pending configure the process pool of subscribe_mp (see _process_pool).
+        By default, there is a worker per CPU.
+        
+        write_batch and write_delay configure how outgoing messages are gathered and priorities sets the default 
+        priority of outgoing messages. queue_size, overflow and overflow_policies configure how many received 
+        messages can wait to be processed and what happens when there are more (see _message_bus).
+        
+        If profile (or the PYIMCLSTS_PROFILE environment variable) is a directory, run() and the child processes 
+        (of use_mp and subscribe_mp) are profiled with cProfile and a profile file per process is written there.'''
         self._use_mp = use_mp
+        bus_options = {'max_batch' : write_batch, 'max_delay' : write_delay, 'priorities' : priorities, 
+                        'queue_size' : queue_size, 'overflow' : overflow, 'overflow_policies' : overflow_policies,
+                        'profile' : profile}
         if self._use_mp:
-            self._msg_manager = message_bus(IO_interface, big_endian)
+            self._msg_manager = message_bus(IO_interface, big_endian, **bus_options)
         else:
-            self._msg_manager = message_bus_st(IO_interface, big_endian)
+            self._msg_manager = message_bus_st(IO_interface, big_endian, **bus_options)
         self._subscriptions = dict()
         self._subscripted_all = []
+        # a dictionary of {(mgid, src, src_ent) : ([callbacks], (indices of subscribe_mp callbacks), cached, borrowed)},
+        # whose src/src_ent filters have already been resolved. Filled as frames arrive.
+        self._routes = dict()
+        # message ids kept by the latest value cache and the cache itself: a dictionary of 
+        # {(mgid, src, src_ent) : [frame, time of arrival, decoded message or None]}. Each entry is 
+        # also stored in (mgid, src, None) and (mgid, None, None), so that any lookup is a single get.
+        self._cached_ids = set()
+        self._latest = dict()
+        # message ids decoded into borrowed messages and the pool of those messages: {mgid : message}
+        self._borrowed = set()
+        self._pool = dict()
+        # a dictionary of {mgid : number of received messages}, the (time, counts) of the last metrics snapshot
+        # and the (host, port) of the metrics endpoint, if any
+        self._msg_counts = dict()
+        self._metrics_last = (_time.monotonic(), dict())
+        self._metrics_address = None
+        # _latency_stats, if the calls are timed
+        self._latency = None
+        # subscriptions whose calls are scheduled as tasks
+        self._concurrent = []
+        # thread pool of subscribe_threaded, managed by the subscriber
+        self._executor = None
+        # callbacks of subscribe_mp and the pool that executes them
+        self._mp_callbacks = []
+        self._mp_pool = _process_pool(self._mp_callbacks, mp_workers, mp_shard_by_src, mp_max_pending, self._msg_manager._big_endian,
+                                        self._msg_manager._profile)
+        # timers of periodic_async and call_once, driven by the scheduler
+        self._scheduler = _scheduler()
         self._periodic = []
         self._call_once = []
 
@@ -506,66 +1810,86 @@ class subscriber:
         
         self.call_once(self._queryEntityList, delay=1)
         self.periodic_async(self._queryEntityList, period=300)
-        self.subscribe_async(self._update_peers, _pg.messages.EntityInfo)
-        self.subscribe_async(self._update_peers, _pg.messages.EntityList)
-        self.subscribe_async(self._update_peers, _pg.messages.Announce)
-
-    async def _periodic_wrapper_coro(self, _period : float, f : Callable, send_callback : Callable[[_core.IMC_message], None]):
-        loop = _asyncio.get_running_loop()
-        while True:
-            last_exec = loop.time()
-            await f(send_callback)
-            now = loop.time()
-            await _asyncio.sleep(max(last_exec - now + _period, 0))
-                
-    async def _periodic_wrapper(self, _period : float, f : Callable, send_callback : Callable[[_core.IMC_message], None]):
-        loop = _asyncio.get_running_loop()
-        f(send_callback)
-        while True:
-            await _asyncio.sleep(_period)
-            loop.call_later(_period, f, send_callback)
+        # Messages that define the names of the peers. They update _peers before their route is resolved 
+        # (see _event_loop), so that they are also given to the subscriptions filtered by the name they define.
+        self._peer_ids = {_get_msg_id(m) for m in (_pg.messages.EntityInfo, _pg.messages.EntityList, _pg.messages.Announce)}
 
     async def _event_loop(self):
         msg_mgr = self._msg_manager
+        metrics_server = None
         try:
             if self._use_mp:
                 msg_mgr.open()
             else:
                 await msg_mgr.open()
-            loop = _asyncio.get_running_loop()
 
-            for f, delay in self._call_once:
-                if delay is not None:
-                    loop.call_later(delay, f, msg_mgr.send)
-                else:
-                    f(msg_mgr.send)
-            
-            # Binding references to background task objects so that they are not garbage collected
-            tasks = []
-            for f, period in self._periodic:
-                if _inspect.iscoroutinefunction(f):
-                    tasks.append(loop.create_task(self._periodic_wrapper_coro(period, f, msg_mgr.send)))
-                elif callable(f):
-                    tasks.append(loop.create_task(self._periodic_wrapper(period, f, msg_mgr.send)))
-                else:
-                    print(f'Warning: Given function {f} is neither Callable nor a coroutine.')
+            self._scheduler.start(self._call_once + self._periodic, msg_mgr.send)
+
+            if self._mp_callbacks:
+                self._mp_pool.start(lambda frame, priority : msg_mgr._forward_raw(frame, priority) if not msg_mgr._block_outgoing else None, 
+                                        msg_mgr._priorities)
+
+            if self._metrics_address is not None:
+                metrics_server = await _asyncio.start_server(self._serve_metrics, *self._metrics_address)
 
+            self._routes = dict()
+            msg_counts = self._msg_counts
+            latency = self._latency
+            peer_ids = self._peer_ids
             while self._keep_running:
                 msg = msg_mgr.recv() if self._use_mp else await msg_mgr.recv()
-                mgid, src, src_ent = _get_id_src_src_ent(msg)
-                if mgid in self._subscriptions:
-                    desel_message = unpack(msg, fast_mode=True)
-                    for f in self._subscriptions[mgid]:
-                        if self._validate_call(src, src_ent, f[1], f[2]):
-                            await f[0](desel_message, msg_mgr.send)
+                route_key = _get_id_src_src_ent(msg)
+                msg_counts[route_key[0]] = msg_counts.get(route_key[0], 0) + 1
+                peer_message = None
+                if route_key[0] in peer_ids:
+                    # May invalidate the route of this very message
+                    peer_message = _pg._base._freeze(unpack(msg, fast_mode=True))
+                    self._update_peers(peer_message, msg_mgr.send)
+                route = self._routes.get(route_key, None)
+                if route is None:
+                    route = self._compile_route(*route_key)
                 
-                [await f[0](unpack(msg, fast_mode=True), msg_mgr.send) for f in self._subscripted_all if self._validate_call(src, src_ent, f[1], f[2])]
+                callbacks, mp_indices, cached, borrowed = route
+                if cached:
+                    # Decoded only if it is read (or given to a callback)
+                    entry = [msg, _time.monotonic(), None]
+                    latest = self._latest
+                    latest[route_key] = entry
+                    latest[(route_key[0], route_key[1], None)] = entry
+                    latest[(route_key[0], None, None)] = entry
+                if mp_indices:
+                    # Workers decode the frame themselves
+                    await self._mp_pool.submit(msg, route_key[1], mp_indices)
+                if callbacks:
+                    # Decode once. The same (frozen) message is given to every callback.
+                    desel_message = (peer_message if peer_message is not None else 
+                                     _pg._base._freeze(unpack(msg, fast_mode=True, pool=self._pool if borrowed else None)))
+                    if cached and not borrowed:
+                        entry[2] = desel_message
+                    if latency is None:
+                        for f in callbacks:
+                            await f(desel_message, msg_mgr.send)
+                    else:
+                        await latency.call(callbacks, desel_message, msg_mgr.send, msg_mgr._reader_queue.last_arrival)
                 # Offer an exit point
                 await _asyncio.sleep(0)
         except EOFError:
             print('Stream has ended.')
         finally:
+            if metrics_server is not None:
+                metrics_server.close()
+            self._scheduler.stop()
+            # Let the scheduled callbacks finish
+            for c in self._concurrent:
+                await c.join()
+            if self._mp_callbacks:
+                await self._mp_pool.close()
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
             msg_mgr.close()
+            if self._latency is not None and self._latency.dump is not None:
+                self._latency.write(self._latency.dump)
 
     async def _abort(self, msg, send_callback):
         if msg._header is not None:
@@ -577,6 +1901,8 @@ class subscriber:
     def _update_peers(self, msg : Union[_pg.messages.EntityList, _pg.messages.Announce, _pg.messages.EntityInfo], send_callback):
         if msg._header is not None:
             src = msg._header.src
+            # src of the frames whose routes must be recompiled (only if something new was learned)
+            changed_srcs = []
             
             if isinstance(msg, _pg.messages.EntityList):
                 if msg.op == msg.OP.REPORT:
@@ -587,9 +1913,12 @@ class subscriber:
                     if name is not None:
                         # if it exists, update; else, create entry
                         if self._peers.get(name, None) is not None:
+                            if self._peers[name].get('EntityList', None) != entList:
+                                changed_srcs.append(src)
                             self._peers[name]['EntityList'] = entList
                         else:
                             self._peers[name] = {'EntityList' : entList}
+                            changed_srcs.append(src)
                     else:
                         if self._peers.get(src, None) is not None:
                             self._peers[src]['EntityList'] = entList
@@ -602,12 +1931,15 @@ class subscriber:
                 if name is not None:
                     # if it exists, update; else, create entry
                     if self._peers.get(name, None) is not None:
+                        if self._peers[name].setdefault('EntityList', dict()).get(msg.label, None) != msg.id:
+                            changed_srcs.append(src)
                         self._peers[name]['EntityList'][msg.label] = msg.id
                     else:
                         self._peers[name] = {'EntityList' : {msg.label : msg.id}}
+                        changed_srcs.append(src)
                 else:
                     if self._peers.get(src, None) is not None:
-                        self._peers[src]['EntityList'][msg.label] = msg.id
+                        self._peers[src].setdefault('EntityList', dict())[msg.label] = msg.id
                     else:
                         self._peers[src] = {'EntityList' : {msg.label : msg.id}}
 
@@ -619,17 +1951,50 @@ class subscriber:
                 temp_value = self._peers.pop(src, None)
                 # check if an int key exists. If it does upgrade it to a normal entry
                 if temp_value is not None:
+                    changed_srcs.append(src)
+                    if self._peers.get(name, None) is not None:
+                        changed_srcs.append(self._peers[name].get('src', None))
                     self._peers[name] = temp_value
                     self._peers[name]['src'] = src
                 else:
                     # if it exists, update; else, create entry
                     if self._peers.get(name, None) is not None:
+                        if self._peers[name].get('src', None) != src:
+                            changed_srcs.extend([src, self._peers[name].get('src', None)])
                         self._peers[name]['src'] = src
                     else:
                         self._peers[name] = {'src' : src}
+                        changed_srcs.append(src)
+            
+            if changed_srcs:
+                self._invalidate_routes(changed_srcs)
         else:
             pass
     
+    def _compile_route(self, mgid : int, src : int, src_ent : int) -> Tuple[list, Tuple[int, ...], bool, bool]:
+        '''Resolves which subscribed callbacks must be called for the frames of the given mgid, src and src_ent
+        (and whether they are cached and decoded into a borrowed message) and stores them in the routing table.'''
+        matches = [f[0] for f in self._subscriptions.get(mgid, []) + self._subscripted_all if self._validate_call(src, src_ent, f[1], f[2])]
+        callbacks = [f for f in matches if not isinstance(f, _mp_subscription)]
+        # Only if every callback is done with the message before the next one is decoded (i.e. none is a task)
+        borrowed = (mgid in self._borrowed and _pg._base._get_message_class(mgid) is not None 
+                    and not any([isinstance(f, _concurrent_callback) for f in callbacks]))
+        if borrowed and mgid not in self._pool:
+            cls = _pg._base._get_message_class(mgid)[0]
+            self._pool[mgid] = cls.__new__(cls)
+        route = (callbacks,
+                 tuple([f.index for f in matches if isinstance(f, _mp_subscription)]),
+                 mgid in self._cached_ids,
+                 borrowed)
+        self._routes[(mgid, src, src_ent)] = route
+        return route
+
+    def _invalidate_routes(self, srcs : list) -> None:
+        '''Removes the routes of the given srcs from the routing table, so that they are recompiled with 
+        the updated peers information.'''
+        for key in [k for k in self._routes if k[1] in srcs]:
+            del self._routes[key]
+    
     def _get_src(self, vehicle_name : str):
         return self._peers[vehicle_name].get('src', None) if self._peers.get(vehicle_name, None) is not None else None
     
@@ -657,7 +2022,8 @@ class subscriber:
             
         return False
     
-    def subscribe_async(self, callback : Callable[[_core.IMC_message, Callable[[_core.IMC_message], None]], None], msg_id : Optional[Union[int, _core.IMC_message, str, _types.ModuleType]] = None, *, src : Optional[str] = None, src_ent : Optional[str] = None):
+    def subscribe_async(self, callback : Callable[[_core.IMC_message, Callable[[_core.IMC_message], None]], None], msg_id : Optional[Union[int, _core.IMC_message, str, _types.ModuleType]] = None, *, src : Optional[str] = None, src_ent : Optional[str] = None,
+                            max_concurrency : Optional[int] = None, ordered : bool = False):
         '''Appends the callback to the list of subscriptions to a message.
         msg_id can be provided as an int, the class of the message, its instance or a category (string (camel case) or module).
         src and src_ent should be provided as strings.
@@ -665,6 +2031,7 @@ class subscriber:
         When a parameters is None, then it is interpreted as 'all'.
 
         The main loop calls the function and pass the message and a callback to send messages.
+        The message is decoded once and shared among all the callbacks, so it is frozen (use .copy() to modify it).
         The return value is discarded and the function must have exactly two parameters (the message and the callback)
         and must not have additional parameters, to avoid unintended behavior*.
         
@@ -677,7 +2044,20 @@ class subscriber:
 
         Tip: If the original function really needs arguments, wrap it with functools.partial.
         Tip2: Use a class instance to keep shared values across different calls. See followRef.py.
+
+        By default, the main loop waits for the callback to finish before reading the next message. If max_concurrency
+        is given, each call is scheduled as a task instead, so that a slow (coroutine) callback does not stall the other
+        subscriptions. At most max_concurrency calls of this subscription are in flight; when the limit is reached, the 
+        main loop waits for one of them to finish. If ordered is True, the calls for messages with the same (message id, src)
+        are executed one after the other, in the order the messages were received.
         '''
+        if max_concurrency is not None and callable(callback):
+            # Wrap once, so that the limit is shared among all the messages of the subscription (e.g. a category)
+            if not _inspect.iscoroutinefunction(callback):
+                callback = _functools.partial(_core._async_wrapper, callback)
+            callback = _concurrent_callback(callback, max_concurrency, ordered)
+            self._concurrent.append(callback)
+
         key = None
         if isinstance(msg_id, _core.IMC_message):
             key = msg_id.Attributes.id
@@ -703,7 +2083,7 @@ class subscriber:
         # (msg_id is None). There cannot be both nor neither.
         if (key is not None) ^ (msg_id is None):
             c = None
-            if _inspect.iscoroutinefunction(callback):
+            if _inspect.iscoroutinefunction(callback) or isinstance(callback, (_concurrent_callback, _mp_subscription)):
                 c = callback
             elif callable(callback):
                 c = _functools.partial(_core._async_wrapper, callback)
@@ -718,23 +2098,219 @@ class subscriber:
                         self._subscriptions[key].append((c, src, src_ent))
                     else:
                         self._subscriptions[key] = [(c, src, src_ent)]
+                self._routes = dict()
+
+    def subscribe_threaded(self, callback : Callable[[_core.IMC_message, Callable[[_core.IMC_message], None]], None], msg_id : Optional[Union[int, _core.IMC_message, str, _types.ModuleType]] = None, *, src : Optional[str] = None, src_ent : Optional[str] = None,
+                            executor : Optional[_futures.Executor] = None, max_pending : int = 32, ordered : bool = False):
+        '''Same as subscribe_async, but the (synchronous) callback is executed in a thread pool, so that CPU or IO heavy
+        functions do not block the main loop.
+
+        If executor is None, a ThreadPoolExecutor managed by the subscriber is used (and shut down when the subscriber stops).
+        At most max_pending calls of this subscription are in flight (running or waiting for a thread); when the limit is reached,
+        the main loop waits for one of them to finish. See subscribe_async for ordered.
+
+        The send callback given to the callback is thread-safe: the messages are sent by the main loop.
+        '''
+        if _inspect.iscoroutinefunction(callback) or not callable(callback):
+            print(f'Warning: Given function {callback} is not a (synchronous) callable.')
+            return
 
-    def periodic_async(self, callback : Callable[[_core.IMC_message], None], period : float):
+        @_functools.wraps(callback)
+        async def run_in_executor(msg : _core.IMC_message, send_callback : Callable) -> None:
+            loop = _asyncio.get_running_loop()
+            await loop.run_in_executor(executor if executor is not None else self._get_executor(), 
+                                        callback, msg, _functools.partial(_threadsafe_send, loop, send_callback))
+
+        self.subscribe_async(run_in_executor, msg_id, src=src, src_ent=src_ent, max_concurrency=max_pending, ordered=ordered)
+
+    def _get_executor(self) -> _futures.Executor:
+        if self._executor is None:
+            self._executor = _futures.ThreadPoolExecutor(thread_name_prefix='pyimclsts')
+        return self._executor
+
+    def periodic_async(self, callback : Callable[[_core.IMC_message], None], period : float) -> _timer:
         '''Add callback to a list to be called every period seconds. Function must take
-        a send callback as parameter. This callback can be used to send messages.'''
-        self._periodic.append((callback, period))
+        a send callback as parameter. This callback can be used to send messages.
+        
+        Calls are scheduled at fixed deadlines (start + n * period), so they do not drift. If a deadline 
+        is missed, the call is skipped and a warning is printed. Returns a handle whose cancel() and 
+        reschedule(period=..., delay=...) methods can be used at any time.'''
+        if not callable(callback):
+            print(f'Warning: Given function {callback} is neither Callable nor a coroutine.')
+        timer = _timer(callback, period)
+        self._periodic.append(timer)
+        if self._scheduler.is_running():
+            self._scheduler.schedule(timer)
+        return timer
 
     def subscribe_mp(self, callback : Callable[[_core.IMC_message, Callable[[_core.IMC_message], None]], None], msg_id : Optional[Union[int, _core.IMC_message, str, _types.ModuleType]] = None, *, src : Optional[str] = None, src_ent : Optional[str] = None):
         '''Calls a function and pass the message and a callback to send messages to it.
         Runs the given callback in a different process and should be used only with heavy load
         functions.
+
+        The callbacks are executed by a pool of persistent worker processes (see the mp_* parameters of the 
+        subscriber), which receive the raw frames and decode them. Messages given to the send callback are
+        serialized by the worker and sent by the subscriber. Since the callback runs in another process, it 
+        cannot change the state of the main process: keep the state in the worker (see mp_shard_by_src).
+        Unless the 'fork' start method is used, the callback must be picklable (e.g. a module level function).
+        Since the workers are started by run(), it must be called before run(). When the subscriber stops, workers 
+        that do not finish their pending frames within 5 seconds are terminated.
+        
+        See subscribe_async for the remaining parameters.
         '''
-        raise NotImplemented
+        if not callable(callback):
+            print(f'Warning: Given function {callback} is neither callable nor a coroutine.')
+            return
+        if self._scheduler.is_running():
+            # The workers have been started with the callbacks subscribed until then
+            raise RuntimeError('subscribe_mp must be called before run().')
+        
+        self._mp_callbacks.append(callback)
+        self.subscribe_async(_mp_subscription(len(self._mp_callbacks) - 1), msg_id, src=src, src_ent=src_ent)
 
-    def call_once(self, callback : Callable[[Callable[[_core.IMC_message], None]], None], delay : Optional[float] = None) -> None:
+    def call_once(self, callback : Callable[[Callable[[_core.IMC_message], None]], None], delay : Optional[float] = None) -> _timer:
         '''Calls the given callbacks as soon as the main loop starts or according to their delay in seconds.
-        Callback parameters must be exactly one callback (that can be used to send messages).'''
-        self._call_once.append((callback, delay))
+        Callback parameters must be exactly one callback (that can be used to send messages).
+        
+        Returns a handle that can be used to cancel or reschedule the call (see periodic_async).'''
+        timer = _timer(callback, None, delay if delay is not None else 0)
+        self._call_once.append(timer)
+        if self._scheduler.is_running():
+            self._scheduler.schedule(timer)
+        return timer
+
+    def cache_latest(self, msg_id : Union[int, _core.IMC_message, str]) -> None:
+        '''Keeps the latest received message of the given id (class or name) for each (src, src_ent), to be read
+        with latest(). The messages are stored as bytes and only decoded when they are read.'''
+        self._cached_ids.add(_get_msg_id(msg_id))
+        self._routes = dict()
+
+    def borrow_messages(self, msg_ids : Optional[list] = None) -> None:
+        '''Decodes the messages of the given ids (classes or names; all, if not given) into a single (borrowed) 
+        message per type, whose fields are refilled in place for every received message, instead of creating 
+        a new message each time. This reduces allocations (and garbage collection) for frequent messages.
+
+        A borrowed message is only valid until the callback returns: callbacks that keep it (or any of its
+        fields that are messages) after that must keep a .copy(). Subscriptions whose calls are scheduled as
+        tasks (max_concurrency, subscribe_threaded) always receive new messages.'''
+        if msg_ids is None:
+            msg_ids = list(_pg.messages._message_ids)
+        self._borrowed.update([_get_msg_id(m) for m in msg_ids])
+        self._routes = dict()
+
+    def latest(self, msg_id : Union[int, _core.IMC_message, str], src : Optional[Union[str, int]] = None, 
+                src_ent : Optional[Union[str, int]] = None) -> Optional[Tuple[_core.IMC_message, float]]:
+        '''Returns the latest received message of the given id (see cache_latest) from the given src and src_ent
+        (names or numbers; if not given, from any of them) and its age, that is, the time in seconds since 
+        it was received, or None if no such message has been received.
+
+        The message is shared (frozen). Use .copy() to modify it.'''
+        mgid = _get_msg_id(msg_id)
+        if mgid not in self._cached_ids:
+            print(f'Warning: Message {msg_id} is not cached. Use cache_latest().')
+            return None
+        
+        if isinstance(src_ent, str):
+            src_ent = self._get_src_ent(src, src_ent) if isinstance(src, str) else None
+            if src_ent is None:
+                return None
+        if isinstance(src, str):
+            src = self._get_src(src)
+            if src is None:
+                return None
+        if src is None and src_ent is not None:
+            # Not indexed. Look for the latest of the given entity.
+            entries = [e for k, e in self._latest.items() if k[0] == mgid and k[2] == src_ent]
+            entry = max(entries, key=lambda e : e[1]) if entries else None
+        else:
+            entry = self._latest.get((mgid, src, src_ent), None)
+        
+        if entry is None:
+            return None
+        if entry[2] is None:
+            entry[2] = _pg._base._freeze(unpack(entry[0], fast_mode=True))
+        return (entry[2], _time.monotonic() - entry[1])
+
+    def set_rate_limit(self, rate : Optional[float], *, msg_id : Optional[Union[int, _core.IMC_message, str]] = None,
+                        dst : Optional[int] = None, burst : Optional[float] = None, policy : str = 'drop',
+                        max_pending : int = 100) -> None:
+        '''Limits the outgoing messages of the given id to the given dst to rate messages per second. Messages over
+        the limit are dropped, delayed or conflated (only the latest one is kept), according to policy.
+
+        See _message_bus.set_rate_limit.'''
+        self._msg_manager.set_rate_limit(rate, msg_id=msg_id, dst=dst, burst=burst, policy=policy, max_pending=max_pending)
+
+    def rate_limit_counters(self) -> dict:
+        '''Returns how many messages have been sent, delayed, conflated and dropped by each rate limit.'''
+        return self._msg_manager.rate_limit_counters()
+
+    def record(self, recorder : Optional[_core.lsf_recorder]) -> None:
+        '''Records every valid received frame with recorder (see lsf_recorder), without a callback per message. 
+        Frames are recorded by the reader of the message bus (in its child process, if use_mp).'''
+        self._msg_manager.record(recorder)
+
+    def metrics(self) -> dict:
+        '''Returns a snapshot of the metrics of the subscriber and its message bus (see _message_bus.metrics): 
+        the number of received messages of each type ('messages'), their rates in messages per second since 
+        the previous snapshot ('rates'), the number of messages of unknown ids ('unknown_messages') and the
+        number of messages waiting in the process pool of subscribe_mp ('mp_pending') and lost by its workers that 
+        exited ('mp_dropped').'''
+        now = _time.monotonic()
+        last_time, last_counts = self._metrics_last
+        counts = dict(self._msg_counts)
+        self._metrics_last = (now, counts)
+        interval = max(now - last_time, 1e-9)
+
+        def name(mgid : int) -> str:
+            message_class = _pg._base._get_message_class(mgid)
+            return message_class[0].__name__ if message_class is not None else str(mgid)
+
+        snapshot = self._msg_manager.metrics()
+        snapshot['messages'] = {name(mgid) : count for mgid, count in counts.items()}
+        snapshot['rates'] = {name(mgid) : (count - last_counts.get(mgid, 0)) / interval for mgid, count in counts.items()}
+        snapshot['unknown_messages'] = sum([count for mgid, count in counts.items() if _pg._base._get_message_class(mgid) is None])
+        snapshot['mp_pending'] = sum(getattr(self._mp_pool, '_pending', None) or [])
+        snapshot['mp_dropped'] = self._mp_pool.dropped
+        return snapshot
+
+    def track_latency(self, slow_threshold : Optional[float] = None, dump : Optional[str] = None) -> None:
+        '''Times every call of the subscribed functions (see latency_stats). Calls that take longer than 
+        slow_threshold seconds are reported with a warning. If dump is given, the statistics are written to
+        this (JSON) file when the subscriber stops. Must be called before run().'''
+        self._latency = _latency_stats(slow_threshold, dump)
+        self._msg_manager._stamp_arrivals = True
+
+    def latency_stats(self) -> dict:
+        '''Returns the statistics of the calls of each subscribed function for each message type:
+        {(function name, message name) : {'duration' : {...}, 'receive_delay' : {...}, 'header_delay' : {...}}}, 
+        where each entry has the count, mean, max and (approximate) 50, 90 and 99 percentiles in seconds of:
+            - 'duration': the duration of the calls;
+            - 'receive_delay': the time from the arrival of the message (to the main process) to the call;
+            - 'header_delay': the time from the timestamp in the header of the message to the call.
+        
+        Functions subscribed with max_concurrency or with subscribe_threaded are only timed until their call 
+        has been scheduled. Functions subscribed with subscribe_mp are not timed. Functions with the same name 
+        (e.g. subscribed twice, or methods of different instances of a class) share an entry.'''
+        return self._latency.snapshot() if self._latency is not None else dict()
+
+    def serve_metrics(self, port : int, host : str = '127.0.0.1') -> None:
+        '''Serves the metrics (see metrics()) as text, one value per line, over HTTP at the given address while
+        the subscriber is running. Rates are computed since the previous request (or snapshot).'''
+        self._metrics_address = (host, port)
+
+    async def _serve_metrics(self, reader : _asyncio.StreamReader, writer : _asyncio.StreamWriter) -> None:
+        try:
+            # Any request gets the metrics
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            body = _format_metrics(self.metrics()).encode()
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; charset=utf-8\r\n' + 
+                            f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
 
     def print_information(self) -> None:
         '''Looks for (and asks for, when applicable) the first Announce and EntityList messages and print them.
@@ -789,4 +2365,146 @@ class subscriber:
         Since it uses asyncio, it blocks the whole interpreter.
         '''
         self._keep_running = True
-        _asyncio.run(self._event_loop())
\ No newline at end of file
+        with _profiler(self._msg_manager._profile, 'subscriber'):
+            _asyncio.run(self._event_loop())
+
+class _gateway_consumer:
+    '''A consumer of a gateway: the bus connected to it, the filters of the frames forwarded to it and its counters.'''
+    __slots__ = ['bus', 'ids', 'src', 'dst', 'filter', 'reply', 'big_endian', 'forwarded', 'filtered', 'unconverted', 'replied']
+
+    def __init__(self, bus : message_bus_st, ids : Optional[set], src : Optional[int], dst : Optional[int], 
+                    filter : Optional[Callable[[_pg._base.header_data], bool]], reply : bool, big_endian : Optional[bool]) -> None:
+        self.bus = bus
+        self.ids = ids
+        self.src = src
+        self.dst = dst
+        self.filter = filter
+        self.reply = reply
+        self.big_endian = big_endian
+        self.forwarded = 0
+        self.filtered = 0
+        self.unconverted = 0
+        self.replied = 0
+
+    def has_filters(self) -> bool:
+        return self.ids is not None or self.src is not None or self.dst is not None or self.filter is not None
+
+    def accepts(self, header : _pg._base.header_data) -> bool:
+        return ((self.ids is None or header.mgid in self.ids) and (self.src is None or header.src == self.src) 
+                and (self.dst is None or header.dst == self.dst) and (self.filter is None or self.filter(header)))
+
+    def send(self, frame : bytes, priority : Optional[int]) -> None:
+        if self.big_endian is not None:
+            try:
+                frame = convert_endianness(frame, self.big_endian)
+            except KeyError:
+                # Unknown message: its layout is not known
+                self.unconverted += 1
+                return
+        self.bus.send_raw(frame, priority = priority)
+        self.forwarded += 1
+
+class gateway:
+    '''Forwards the frames received from an IO interface (e.g. a vehicle) to one or more consumers (e.g. shore 
+    applications) and, optionally, the frames sent by the consumers back to it.
+
+    Frames are validated (CRC), but forwarded byte-for-byte with send_raw: they are never decoded nor re-encoded, so
+    the cost of forwarding a frame does not depend on its message. Filters only read the header (see header_view).
+    '''
+
+    __slots__ = ['_bus', '_consumers', '_bus_options', '_priority', '_keep_running']
+
+    def __init__(self, IO_interface : _core.base_IO_interface, *, keep_order : bool = False, write_batch : int = 64, 
+                    write_delay : float = 0, queue_size : Optional[int] = 1024, overflow : str = 'block') -> None:
+        '''Frames are forwarded according to their priority (see set_priority), unless keep_order, in which case 
+        they are forwarded in the order they were received. write_batch, write_delay, queue_size and overflow 
+        configure the buses of the gateway (see _message_bus).'''
+        self._priority = PRIORITY_NORMAL if keep_order else None
+        self._bus_options = {'max_batch' : write_batch, 'max_delay' : write_delay, 
+                                'queue_size' : queue_size, 'overflow' : overflow}
+        self._bus = message_bus_st(IO_interface, **self._bus_options)
+        self._consumers = []
+        self._keep_running = False
+
+    def add_consumer(self, IO_interface : _core.base_IO_interface, msg_ids : Optional[list] = None, *, 
+                        src : Optional[int] = None, dst : Optional[int] = None, 
+                        filter : Optional[Callable[[_pg._base.header_data], bool]] = None, reply : bool = True, 
+                        big_endian : Optional[bool] = None) -> None:
+        '''Forwards the frames of the given message ids (classes or names; all, if not given), from the given src and
+        to the given dst (as ints) to IO_interface. filter is an optional predicate on the header of the frames. 
+        If reply, the frames sent by the consumer are forwarded to the source.
+        
+        If big_endian is given, frames are converted to that endianness (see convert_endianness) and those of
+        unknown messages are not forwarded.'''
+        ids = {_get_msg_id(m) for m in msg_ids} if msg_ids is not None else None
+        self._consumers.append(_gateway_consumer(message_bus_st(IO_interface, **self._bus_options), ids, src, dst, filter, 
+                                                    reply, big_endian))
+
+    def metrics(self) -> dict:
+        '''Returns the metrics of the bus of the source and of each consumer (see _message_bus.metrics), together with
+        the number of frames forwarded to (filtered out for, or not converted for) each consumer and forwarded back from it.'''
+        return {'source' : self._bus.metrics(),
+                'consumers' : [dict(c.bus.metrics(), forwarded = c.forwarded, filtered = c.filtered, unconverted = c.unconverted, 
+                                    replied = c.replied) 
+                                for c in self._consumers]}
+
+    async def _forward(self) -> None:
+        bus = self._bus
+        consumers = self._consumers
+        priority = self._priority
+        filtered = [c for c in consumers if c.has_filters()]
+        unfiltered = [c for c in consumers if not c.has_filters()]
+        try:
+            while self._keep_running:
+                frame = await bus.recv()
+                for c in unfiltered:
+                    c.send(frame, priority)
+                if filtered:
+                    header = header_view(frame)
+                    for c in filtered:
+                        if c.accepts(header):
+                            c.send(frame, priority)
+                        else:
+                            c.filtered += 1
+        except EOFError:
+            print('Stream has ended.')
+
+    async def _reply(self, consumer : _gateway_consumer) -> None:
+        bus = self._bus
+        try:
+            while self._keep_running:
+                bus.send_raw(await consumer.bus.recv(), priority = self._priority)
+                consumer.replied += 1
+        except EOFError:
+            pass
+
+    async def _event_loop(self) -> None:
+        buses = [self._bus] + [c.bus for c in self._consumers]
+        for bus in buses:
+            await bus.open()
+        forward = _asyncio.create_task(self._forward())
+        replies = [_asyncio.create_task(self._reply(c)) for c in self._consumers if c.reply]
+        try:
+            # Check from time to time whether it has been stopped
+            while self._keep_running and not forward.done():
+                await _asyncio.wait([forward], timeout=0.5)
+            if forward.done():
+                forward.result()
+            # Let the buses write what has been forwarded
+            for bus in buses:
+                await bus.flush()
+        finally:
+            for task in [forward] + replies:
+                task.cancel()
+            for bus in buses:
+                bus.close()
+
+    def stop(self) -> None:
+        '''Signals the gateway to stop.'''
+        self._keep_running = False
+
+    def run(self) -> None:
+        '''Opens the IO interfaces and forwards frames until the source ends or the gateway is stopped. 
+        Since it uses asyncio, it blocks the whole interpreter.'''
+        self._keep_running = True
+        _asyncio.run(self._event_loop())